@@ -22,7 +22,10 @@ from copy import deepcopy
 from datetime import date
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ALL_VAR, ERROR_FLAG, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.formats import date_format
@@ -31,12 +34,13 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import get_language, gettext_lazy as _, to_locale
 from moneyed.localization import format_money
 
-from django_pain.constants import PaymentState
+from django_pain.constants import InvoiceType, PaymentState
 from django_pain.models import BankPayment, Invoice
 from django_pain.settings import get_processor_instance
 
 from .filters import PaymentStateListFilter
 from .forms import BankAccountForm, BankPaymentForm, UserCreationForm
+from .paginators import EstimatedCountPaginator
 
 
 class BankAccountAdmin(admin.ModelAdmin):
@@ -51,10 +55,6 @@ class BankAccountAdmin(admin.ModelAdmin):
         else:
             return ('currency',)
 
-    def get_queryset(self, request):
-        """Override super's get_queryset to add locking."""
-        return super().get_queryset(request).select_for_update()
-
 
 class InvoicesInline(admin.TabularInline):
     """Inline model admin for invoices related to payment."""
@@ -88,10 +88,6 @@ class InvoicesInline(admin.TabularInline):
         """Read only access."""
         return False
 
-    def get_queryset(self, request):
-        """Override super's get_queryset to add locking."""
-        return super().get_queryset(request).select_for_update()
-
 
 class BankPaymentAdmin(admin.ModelAdmin):
     """Model admin for BankPayment."""
@@ -118,13 +114,38 @@ class BankPaymentAdmin(admin.ModelAdmin):
 
     ordering = ('-transaction_date', '-create_time')
 
+    # Counting all payments is slow on large tables.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Query parameters of the changelist which don't filter the payments.
+    unfiltered_params = (ALL_VAR, ORDER_VAR, PAGE_VAR, IS_POPUP_VAR, TO_FIELD_VAR, ERROR_FLAG)
+    # Filter values which select all payments.
+    unfiltered_values = {'state__exact': 'all'}
+
     inlines = (
         InvoicesInline,
     )
 
     def get_queryset(self, request):
-        """Override super's get_queryset to add locking."""
-        return super().get_queryset(request).select_for_update()
+        """
+        Override super's get_queryset to fetch related objects in bulk.
+
+        The number of queries of the changelist doesn't depend on the number of displayed payments.
+        Payments are not locked, `BankPaymentForm` locks the payment only when it is assigned to a processor.
+        """
+        return super().get_queryset(request).select_related('account', 'client').prefetch_related(
+            Prefetch('invoices', queryset=Invoice.objects.order_by('pk'), to_attr='prefetched_invoices'))
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        """
+        Use estimated count only for the default list of payments.
+
+        Searched or filtered payments are counted exactly, because estimates of such queries are often far off.
+        """
+        if any(value and value != self.unfiltered_values.get(param)
+               for param, value in request.GET.items() if param not in self.unfiltered_params):
+            return Paginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
 
     class Media:
         """Media class."""
@@ -251,8 +272,14 @@ class BankPaymentAdmin(admin.ModelAdmin):
         If there are any other invoices, number of remaining (not displayed)
         invoices is displayed as well.
         """
-        advance_invoice = obj.advance_invoice
-        invoices_count = obj.invoices.count()
+        invoices = getattr(obj, 'prefetched_invoices', None)
+        if invoices is None:
+            advance_invoice = obj.advance_invoice
+            invoices_count = obj.invoices.count()
+        else:
+            advance_invoice = next((invoice for invoice in invoices if invoice.invoice_type == InvoiceType.ADVANCE),
+                                   None)
+            invoices_count = len(invoices)
         if advance_invoice is not None:
             processor = get_processor_instance(obj.processor)
             if hasattr(processor, 'get_invoice_url'):
@@ -66,6 +66,7 @@ class BankPaymentForm(forms.ModelForm):
         """
         cleaned_data = super().clean()
         if cleaned_data.get('processor'):
+            self._lock_payment()
             # The only valid choices are those from PAIN_PROCESSORS settings.
             # Those are already validated during startup.
             processor = get_processor_instance(cleaned_data['processor'])
@@ -88,6 +89,19 @@ class BankPaymentForm(forms.ModelForm):
                 else:
                     raise forms.ValidationError(_('Unable to assign payment'), code='unable_to_assign')
 
+    def _lock_payment(self) -> None:
+        """
+        Lock the payment before it is assigned to a processor.
+
+        Admin displays payments without locking, so check the payment has not been changed in the meantime,
+        e.g. processed by `process_payments`. The lock is held until the end of the request transaction.
+        """
+        if self.instance.pk is None:
+            return
+        state = BankPayment.objects.select_for_update().values_list('state', flat=True).get(pk=self.instance.pk)
+        if state != self.instance.state:
+            raise forms.ValidationError(_('Payment has been changed in the meantime'), code='changed')
+
     def save(self, commit=True):
         """Manually assign payment objective and save payment."""
         if 'state' in self.cleaned_data:
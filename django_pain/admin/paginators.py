@@ -0,0 +1,61 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Admin paginators."""
+import json
+from typing import Optional
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from django_pain.settings import SETTINGS
+
+
+def estimate_count(queryset: QuerySet) -> Optional[int]:
+    """Return number of rows of the queryset estimated by PostgreSQL query planner or None if not available."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using estimated number of objects for large querysets.
+
+    Querysets estimated to have at least PAIN_ADMIN_EXACT_COUNT_LIMIT rows use the estimate,
+    smaller querysets are counted exactly.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        """Return estimated or exact number of objects."""
+        limit = SETTINGS.admin_exact_count_limit
+        if limit and isinstance(self.object_list, QuerySet):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= limit:
+                return estimate
+        return super().count
@@ -17,7 +17,8 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """CardPaymentHandler module."""
-from .common import AbstractCardPaymentHandler, CartItem, PaymentHandlerConnectionError, PaymentHandlerError
+from .common import (AbstractCardPaymentHandler, CartItem, PaymentHandlerConnectionError, PaymentHandlerError,
+                     PaymentStateResult)
 from .csob import CSOBCardPaymentHandler
 
 __all__ = [
@@ -26,4 +27,5 @@ __all__ = [
     'CSOBCardPaymentHandler',
     'PaymentHandlerError',
     'PaymentHandlerConnectionError',
+    'PaymentStateResult',
 ]
@@ -18,8 +18,9 @@
 
 """Base payment processor module."""
 from abc import ABC, abstractmethod
-from typing import List, NamedTuple, Tuple
+from typing import Iterable, List, NamedTuple, Optional, Tuple
 
+from django.db import transaction
 from djmoney.money import Money
 
 from django_pain.models import BankPayment
@@ -44,6 +45,14 @@ class PaymentHandlerConnectionError(PaymentHandlerError):
     pass
 
 
+# Result of getting state of a card payment.
+# Payment has its state attributes updated unless error occured.
+PaymentStateResult = NamedTuple('PaymentStateResult', [
+    ('payment', BankPayment),
+    ('error', Optional[PaymentHandlerError]),
+])
+
+
 class AbstractCardPaymentHandler(ABC):
     """Card payment handler."""
 
@@ -74,3 +83,26 @@ class AbstractCardPaymentHandler(ABC):
     @abstractmethod
     def update_payments_state(self, payment: BankPayment) -> None:
         """Update state of the payment form Card Gateway and if newly paid, process the payment."""
+
+    def get_payments_states(self, payments: Iterable[BankPayment]) -> List[PaymentStateResult]:
+        """
+        Get states of the payments from Card Gateway.
+
+        Updates state attributes of the payments, but does not save them.
+        Errors of individual payments are returned in the results, so the caller can save all changed payments at once.
+
+        Default implementation calls `update_payments_state` for each payment and rolls back its database changes.
+        Descendants should override this method to get the states more efficiently.
+        """
+        results = []
+        for payment in payments:
+            try:
+                with transaction.atomic():
+                    self.update_payments_state(payment)
+                    # Payment is saved by the caller.
+                    transaction.set_rollback(True)
+            except PaymentHandlerError as error:
+                results.append(PaymentStateResult(payment, error))
+            else:
+                results.append(PaymentStateResult(payment, None))
+        return results
@@ -17,17 +17,22 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Card handler for CSOB Gateway."""
+import inspect
 import logging
-from typing import Dict, List, Tuple
+import random
+from typing import Dict, Iterable, List, Tuple
 
 import requests
+import requests.adapters
 from django.utils import timezone
 from djmoney.money import Money
 from pycsob import conf as CSOB
-from pycsob.client import CsobClient
+from urllib3.util.retry import Retry
 
 from django_pain.card_payment_handlers.common import (AbstractCardPaymentHandler, CartItem,
-                                                      PaymentHandlerConnectionError, PaymentHandlerError)
+                                                      PaymentHandlerConnectionError, PaymentHandlerError,
+                                                      PaymentStateResult)
+from django_pain.card_payment_handlers.csob_signing import CachedKeysCsobClient
 from django_pain.constants import PaymentState, PaymentType
 from django_pain.models import BankAccount, BankPayment
 from django_pain.settings import SETTINGS
@@ -49,6 +54,54 @@ CSOB_GATEWAY_TO_PAYMENT_STATE_MAPPING = {
 }
 
 
+# Parameter `method_whitelist` was renamed to `allowed_methods` in urllib3 1.26.
+if 'allowed_methods' in inspect.signature(Retry.__init__).parameters:
+    RETRY_METHODS_PARAM = 'allowed_methods'
+else:
+    RETRY_METHODS_PARAM = 'method_whitelist'  # pragma: no cover
+
+
+class JitterRetry(Retry):
+    """
+    Retry policy which retries only GET requests by default and adds random jitter to the backoff time.
+
+    Only payment status requests are sent using GET, other requests to CSOB Gateway are not idempotent.
+    """
+
+    def __init__(self, *args, jitter: float = 0, **kwargs):
+        kwargs.setdefault(RETRY_METHODS_PARAM, frozenset(['GET']))
+        super().__init__(*args, **kwargs)
+        self.jitter = jitter
+
+    def new(self, **kwargs):
+        """Return copy of the retry policy with updated counters."""
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self) -> float:
+        """Return backoff time with random jitter."""
+        return super().get_backoff_time() + random.uniform(0, self.jitter)
+
+
+class CSOBHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter with connection pool, retries and default timeout configured in PAIN_CSOB_CARD setting."""
+
+    def __init__(self):
+        settings = SETTINGS.csob_card
+        self.timeout = (settings['connect_timeout'], settings['read_timeout'])
+        retry = JitterRetry(total=settings['status_retries'], backoff_factor=settings['retry_backoff'],
+                            status_forcelist=(502, 503, 504), raise_on_status=False, jitter=settings['retry_jitter'])
+        super().__init__(pool_connections=settings['pool_size'], pool_maxsize=settings['pool_size'],
+                         max_retries=retry)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        """Send request with default timeout."""
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+
 class CSOBCardPaymentHandler(AbstractCardPaymentHandler):
     """CSOB Gateway card payment processor."""
 
@@ -60,14 +113,27 @@ class CSOBCardPaymentHandler(AbstractCardPaymentHandler):
     def client(self):
         """Get CSOB Gateway Client."""
         if self._client is None:
-            self._client = CsobClient(
+            self._client = CachedKeysCsobClient(
                 SETTINGS.csob_card['merchant_id'],
                 SETTINGS.csob_card['api_url'],
                 str(SETTINGS.csob_card['merchant_private_key']),
-                str(SETTINGS.csob_card['api_public_key'])
+                str(SETTINGS.csob_card['api_public_key']),
+                session=self._create_session(),
             )
         return self._client
 
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """Create HTTP session for CSOB Gateway Client according to PAIN_CSOB_CARD setting."""
+        session = requests.Session()
+        session.headers.update(CSOB.HEADERS)
+        adapter = CSOBHTTPAdapter()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not SETTINGS.csob_card['keep_alive']:
+            session.headers['Connection'] = 'close'
+        return session
+
     def init_payment(self, amount: Money, variable_symbol: str, processor: str, return_url: str,
                      return_method: str, cart: List[CartItem], language: str) -> Tuple[BankPayment, str]:
         """Initialize card payment on the CSOB gateway, see parent class for detailed description."""
@@ -86,7 +152,7 @@ class CSOBCardPaymentHandler(AbstractCardPaymentHandler):
                 # logo_version=PAYMENTS_SETTINGS.PAYMENTS_CSOB_LOGO_VERSION,
                 # color_scheme_version=PAYMENTS_SETTINGS.PAYMENTS_CSOB_COLOR_SCHEME_VERSION, merchant_data=merchant_data
             )
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             raise PaymentHandlerConnectionError('Gateway connection error')
 
         data = self.client.gateway_return(response.json())
@@ -115,9 +181,26 @@ class CSOBCardPaymentHandler(AbstractCardPaymentHandler):
 
     def update_payments_state(self, payment: BankPayment) -> None:
         """Update status of the payment form CSOB Gateway and if newly paid, process the payment."""
+        self._update_state(payment)
+        payment.save()
+
+    def get_payments_states(self, payments: Iterable[BankPayment]) -> List[PaymentStateResult]:
+        """Get states of the payments from CSOB Gateway without saving them, see parent class for details."""
+        results = []
+        for payment in payments:
+            try:
+                self._update_state(payment)
+            except PaymentHandlerError as error:
+                results.append(PaymentStateResult(payment, error))
+            else:
+                results.append(PaymentStateResult(payment, None))
+        return results
+
+    def _update_state(self, payment: BankPayment) -> None:
+        """Update state attributes of the payment from CSOB Gateway."""
         try:
             gateway_result = self.client.payment_status(payment.identifier).payload
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             raise PaymentHandlerConnectionError('Gateway connection error')
         if gateway_result['resultCode'] == CSOB.RETURN_CODE_OK:
             payment.card_payment_state = CSOB.PAYMENT_STATUSES[gateway_result['paymentStatus']]
@@ -125,7 +208,6 @@ class CSOBCardPaymentHandler(AbstractCardPaymentHandler):
             # PROCESSED to READY_TO_PROCESS again.
             if payment.state == PaymentState.INITIALIZED:
                 payment.state = CSOB_GATEWAY_TO_PAYMENT_STATE_MAPPING[gateway_result['paymentStatus']]
-            payment.save()
         else:
             LOGGER.error('payment_status resultCode != OK: %s', gateway_result)
             raise PaymentHandlerError('payment_status resultCode != OK', gateway_result)
@@ -0,0 +1,173 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Signing of CSOB Gateway messages using keys parsed once per process."""
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Iterable, Mapping, Optional, Tuple
+
+import requests
+from Crypto.Hash import SHA1
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from pycsob import conf as CSOB, utils
+from pycsob.client import CsobClient
+
+
+@lru_cache()
+def load_key(key_file: str) -> Any:
+    """Load and parse RSA key from the file. Keys are cached, so each file is parsed only once per process."""
+    with open(key_file) as handle:
+        return RSA.importKey(handle.read())
+
+
+def sign(payload: Mapping[str, Any], key_file: str) -> str:
+    """Return signature of the payload using private key from the key file, see `pycsob.utils.sign`."""
+    signer = PKCS1_v1_5.new(load_key(key_file))
+    return b64encode(signer.sign(SHA1.new(utils.mk_msg_for_sign(payload)))).decode()
+
+
+def verify(payload: Mapping[str, Any], signature: str, key_file: str) -> bool:
+    """Verify signature of the payload using public key from the key file, see `pycsob.utils.verify`."""
+    verifier = PKCS1_v1_5.new(load_key(key_file))
+    return verifier.verify(SHA1.new(utils.mk_msg_for_sign(payload)), b64decode(signature))
+
+
+def mk_payload(key_file: str, pairs: Iterable[Tuple[str, Any]]) -> 'OrderedDict[str, Any]':
+    """Return signed request payload, see `pycsob.utils.mk_payload`."""
+    payload = OrderedDict((key, value) for key, value in pairs if value not in CSOB.EMPTY_VALUES)
+    payload['signature'] = sign(payload, key_file)
+    return payload
+
+
+class CachedKeysCsobClient(CsobClient):
+    """
+    CSOB Gateway Client which signs and verifies messages using cached keys.
+
+    Requests used by `CSOBCardPaymentHandler` - payment init, payment process URL, gateway return
+    and payment status - use cached keys. Other requests are left to `CsobClient`.
+
+    HTTP session of the client may be provided by `session` argument.
+    """
+
+    def __init__(self, merchant_id, base_url, private_key_file, csob_pub_key_file,
+                 session: Optional[requests.Session] = None):
+        super().__init__(merchant_id, base_url, private_key_file, csob_pub_key_file)
+        if session is not None:
+            # Session is used by requests inherited from `CsobClient` as well.
+            self._client = session
+
+    @property
+    def session(self) -> requests.Session:
+        """Return HTTP session of the client."""
+        return self._client
+
+    def payment_init(self, order_no, total_amount, return_url, description, cart=None,
+                     customer_id=None, currency='CZK', language='CZ', close_payment=True,
+                     return_method='POST', pay_operation='payment', ttl_sec=600,
+                     logo_version=None, color_scheme_version=None, merchant_data=None):
+        """Initialize transaction on the gateway, see `CsobClient.payment_init`."""
+        if len(description) > 255:
+            raise ValueError('Description length is over 255 chars')
+        if merchant_data:
+            merchant_data = b64encode(merchant_data).decode('UTF-8')
+            if len(merchant_data) > 255:
+                raise ValueError('Merchant data length encoded to BASE64 is over 255 chars')
+        if not cart:
+            cart = [OrderedDict([('name', description[:20].strip()), ('quantity', 1), ('amount', total_amount)])]
+        # Fix invalid language code type (country code).
+        lang_code = language.upper()[:2]
+        language = {'CS': 'CZ'}.get(lang_code, lang_code)
+
+        payload = mk_payload(self.f_key, pairs=(
+            ('merchantId', self.merchant_id),
+            ('orderNo', str(order_no)),
+            ('dttm', utils.dttm()),
+            ('payOperation', pay_operation),
+            ('payMethod', 'card'),
+            ('totalAmount', total_amount),
+            ('currency', currency),
+            ('closePayment', close_payment),
+            ('returnUrl', return_url),
+            ('returnMethod', return_method),
+            ('cart', cart),
+            ('description', description),
+            ('merchantData', merchant_data),
+            ('customerId', customer_id),
+            ('language', language),
+            ('ttlSec', ttl_sec),
+            ('logoVersion', logo_version),
+            ('colorSchemeVersion', color_scheme_version),
+        ))
+        url = utils.mk_url(base_url=self.base_url, endpoint_url='payment/init')
+        return self.validate_response(self.session.post(url, data=json.dumps(payload)))
+
+    def req_payload(self, pay_id, **kwargs):
+        """Return signed payload of request identified by payment ID."""
+        pairs = (
+            ('merchantId', self.merchant_id),
+            ('payId', pay_id),
+            ('dttm', utils.dttm()),
+        )  # type: Tuple[Tuple[str, Any], ...]
+        for key, value in kwargs.items():
+            if value not in CSOB.EMPTY_VALUES:
+                pairs += ((key, value),)
+        return mk_payload(self.f_key, pairs)
+
+    def payment_status(self, pay_id):
+        """Get payment status from the gateway."""
+        url = utils.mk_url(base_url=self.base_url, endpoint_url='payment/status/', payload=self.req_payload(pay_id))
+        return self.validate_response(self.session.get(url=url))
+
+    def gateway_return(self, datadict):
+        """Return verified data of return from the gateway."""
+        data = OrderedDict()  # type: OrderedDict
+        for key in CSOB.RESPONSE_KEYS:
+            if key in datadict:
+                data[key] = int(datadict[key]) if key in ('resultCode', 'paymentStatus') else datadict[key]
+        if not verify(data, datadict['signature'], self.f_pubkey):
+            raise utils.CsobVerifyError('Unverified gateway return data')
+        if 'dttm' in data:
+            data['dttime'] = utils.dttm_decode(data['dttm'])
+        if 'merchantData' in data:
+            data['merchantData'] = b64decode(data['merchantData'])
+        return data
+
+    def validate_response(self, response):
+        """Verify response from the gateway, see `pycsob.utils.validate_response`."""
+        response.raise_for_status()
+
+        data = response.json()
+        signature = data.pop('signature')
+        payload = OrderedDict((key, data[key]) for key in CSOB.RESPONSE_KEYS if key in data)
+        if not verify(payload, signature, self.f_pubkey):
+            raise utils.CsobVerifyError('Cannot verify response')
+        if 'dttm' in payload:
+            payload['dttime'] = utils.dttm_decode(payload['dttm'])
+
+        response.extensions = []
+        response.payload = payload
+        for extension in data.get('extensions', []):
+            if extension['extension'] == 'maskClnRP':
+                keys = ('extension', 'dttm', 'maskedCln', 'expiration', 'longMaskedCln')
+                masked_card = OrderedDict((key, extension[key]) for key in keys if key in extension)
+                if verify(masked_card, extension['signature'], self.f_pubkey):
+                    response.extensions.append(masked_card)
+        return response
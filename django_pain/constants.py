@@ -23,6 +23,9 @@ from enum import Enum, unique
 # Bitcoin has 8, so 10 should be enough for most practical purposes.
 CURRENCY_PRECISION = 10
 
+# Maximal number of payments updated by one query.
+UPDATE_BATCH_SIZE = 500
+
 
 @unique
 class PaymentType(str, Enum):
@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Locks preventing concurrent runs of commands."""
+import fcntl
+import hashlib
+from abc import ABC, abstractmethod
+from typing import IO, Optional
+
+from django.db import connection
+
+
+class LockError(Exception):
+    """Lock could not be acquired due to an error."""
+
+
+class AbstractLock(ABC):
+    """
+    Non-blocking exclusive lock identified by its name.
+
+    Lock must be released by the same object which acquired it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @abstractmethod
+    def acquire(self) -> bool:
+        """
+        Acquire the lock.
+
+        Return False if the lock is held by someone else. Raise LockError if the lock can not be acquired at all.
+        """
+
+    @abstractmethod
+    def release(self) -> None:
+        """Release the acquired lock."""
+
+
+class FileLock(AbstractLock):
+    """Lock using `flock` on a lock file. Name of the lock is a path to the lock file."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._file = None  # type: Optional[IO]
+
+    def acquire(self) -> bool:
+        """Acquire the lock."""
+        try:
+            self._file = open(self.name, 'a')
+        except OSError as error:
+            raise LockError('Error occured while opening lockfile {}: {}'.format(self.name, str(error)))
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self) -> None:
+        """Release the acquired lock."""
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class PostgresAdvisoryLock(AbstractLock):
+    """
+    Lock using PostgreSQL session level advisory lock.
+
+    The lock is shared by all hosts using the same database.
+    The lock is held by the default database connection, which has to stay open until the lock is released.
+    """
+
+    @property
+    def key(self) -> int:
+        """Return advisory lock key derived from the lock name as signed 64-bit integer."""
+        return int.from_bytes(hashlib.sha256(self.name.encode()).digest()[:8], 'big', signed=True)
+
+    def acquire(self) -> bool:
+        """Acquire the lock."""
+        if connection.vendor != 'postgresql':
+            raise LockError('Advisory lock {} requires PostgreSQL database'.format(self.name))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+            return cursor.fetchone()[0]
+
+    def release(self) -> None:
+        """Release the acquired lock."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.key])
@@ -0,0 +1,73 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Base of commands saving payments to database."""
+import logging
+from typing import List, Set, Tuple
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db.utils import IntegrityError
+
+from django_pain.models import BankPayment
+
+
+class SavePaymentsCommand(BaseCommand):
+    """
+    Base of commands saving payments to database.
+
+    Rejected payments are logged by the logger of the command module and written to the error output.
+    """
+
+    @staticmethod
+    def _get_existing_keys(payments: List[BankPayment]) -> Set[Tuple[str, int]]:
+        """Return set of (identifier, account) pairs of payments already present in database."""
+        if not payments:
+            return set()
+        query = BankPayment.objects.filter(account_id__in=set(payment.account_id for payment in payments),
+                                           identifier__in=set(payment.identifier for payment in payments))
+        return set(query.values_list('identifier', 'account_id'))
+
+    def _report_imported(self, payment: BankPayment) -> None:
+        if self.options['verbosity'] >= 2:
+            self.stdout.write(self.style.SUCCESS('Payment ID {} has been imported.'.format(payment.identifier)))
+
+    def _report_validation_error(self, payment: BankPayment, error: ValidationError) -> None:
+        logger = logging.getLogger(type(self).__module__)
+        message = 'Payment ID %s has not been saved due to the following errors:'
+        logger.warning(message, payment.identifier)
+        if self.options['verbosity'] >= 1:
+            self.stderr.write(self.style.WARNING(message % payment.identifier))
+
+        if hasattr(error, 'message_dict'):
+            for field in error.message_dict:
+                prefix = '{}: '.format(field) if field != '__all__' else ''
+                for message in error.message_dict[field]:
+                    logger.warning('%s%s', prefix, message)
+                    if self.options['verbosity'] >= 1:
+                        self.stderr.write(self.style.WARNING('%s%s' % (prefix, message)))
+        else:
+            logger.warning('\n'.join(error.messages))
+            if self.options['verbosity'] >= 1:
+                self.stderr.write(self.style.WARNING('\n'.join(error.messages)))
+
+    def _report_integrity_error(self, payment: BankPayment, error: IntegrityError) -> None:
+        message = 'Payment ID %s has not been saved due to the following error: %s'
+        logging.getLogger(type(self).__module__).warning(message, payment.identifier, str(error))
+        if self.options['verbosity'] >= 1:
+            self.stderr.write(self.style.WARNING(message % (payment.identifier, str(error))))
@@ -18,29 +18,34 @@
 
 """Command for downloading payments from bank."""
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
-from typing import Iterable, Optional, Tuple
+from time import monotonic
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.management.base import BaseCommand, CommandError, no_translations
+from django.core.management.base import CommandError, no_translations
 from django.db import transaction
 from django.db.utils import IntegrityError
 from django.utils import timezone
 from teller.statement import BankStatement
 
-from django_pain.models import BankAccount, BankPayment
+from django_pain.management.commands._save_payments import SavePaymentsCommand
+from django_pain.models import BankAccount, BankPayment, DownloadWatermark
 from django_pain.settings import SETTINGS
-from django_pain.utils import parse_date_safe
+from django_pain.utils import parse_date_safe, parse_positive_float, parse_positive_int
 
 LOGGER = logging.getLogger(__name__)
 
 
-class Command(BaseCommand):
+class Command(SavePaymentsCommand):
     """Download payments from banks."""
 
     help = 'Download payments from the banks.'
     default_interval = 7
+    default_overlap = 1
 
     def add_arguments(self, parser):
         """Command takes two argument - end date and interval in days."""
@@ -48,6 +53,16 @@ class Command(BaseCommand):
                             help='end date of the download interval, default: TODAY')
         parser.add_argument('-s', '--start', type=parse_date_safe, required=False,
                             help='start date of the download interval, default: END minus seven days')
+        parser.add_argument('-j', '--jobs', type=parse_positive_int, default=None,
+                            help='download statements concurrently using given number of threads')
+        parser.add_argument('--timeout', type=parse_positive_float, default=None,
+                            help='timeout in seconds of network operations of the downloaders')
+        parser.add_argument('-i', '--incremental', action='store_true',
+                            help='start the download interval at the date of the last downloaded transaction '
+                                 'of each downloader minus OVERLAP days, START is used for new downloaders')
+        parser.add_argument('--overlap', type=int, default=self.default_overlap,
+                            help='number of days already downloaded which are downloaded again in the incremental '
+                                 'mode, default: {}'.format(self.default_overlap))
 
     @no_translations
     def handle(self, *args, **options):
@@ -56,41 +71,117 @@ class Command(BaseCommand):
         LOGGER.info('Command download_payments started.')
 
         start_date, end_date = self._set_dates(options['start'], options['end'])
+        if options['incremental']:
+            if options['overlap'] < 0:
+                raise CommandError('Overlap has to be a non-negative number of days.')
+            start_dates = self._get_incremental_start_dates(start_date, end_date, options['overlap'])
+        else:
+            start_dates = dict((key, start_date) for key in SETTINGS.downloaders)
 
-        for key, value in SETTINGS.downloaders.items():
-            LOGGER.info('Processing: {}'.format(key))
+        if options['jobs'] is not None:
+            self._download_concurrently(start_dates, end_date, options['jobs'])
+        else:
+            for key, value in SETTINGS.downloaders.items():
+                statement = self._download(key, value, start_dates[key], end_date)
+                if statement is not None:
+                    self._save_statement(key, statement)
 
-            downloader_class = value['DOWNLOADER']
-            parser_class = value['PARSER']
+        LOGGER.info('Command download_payments finished.')
 
-            try:
-                downloader = downloader_class(**value['DOWNLOADER_PARAMS'])
-            except Exception:
-                # Do not log the error message here as it may contain sensitive information such as login credentials.
-                LOGGER.error('Could not init Downloader for %s.', key)
-                continue
-            try:
-                # TODO: urllib3.connectionpool logs the URL in the DEBUG mode
-                LOGGER.debug('Downloading payments for %s.', key)
-                raw_statement = downloader.get_statement(start_date, end_date)
-            except Exception:
-                # Do not log the error message here as it may contain sensitive information such as login credentials.
-                LOGGER.error('Downloading payments for %s failed.', key)
-                continue
+    def _download(self, key: str, value: Dict[str, Any], start_date: date, end_date: date) -> Optional[BankStatement]:
+        """Download and parse bank statement. Return None if download failed."""
+        LOGGER.info('Processing: {}'.format(key))
 
-            LOGGER.debug('Parsing payments for %s.', key)
-            try:
-                statement = parser_class.parse_string(raw_statement)
-            except Exception as e:
-                LOGGER.error(str(e))
-                continue
+        downloader_class = value['DOWNLOADER']
+        parser_class = value['PARSER']
 
-            payments = self._convert_to_models(statement)
+        params = dict(value['DOWNLOADER_PARAMS'])
+        if self.options['timeout'] is not None:
+            params['timeout'] = self.options['timeout']
+        try:
+            downloader = downloader_class(**params)
+        except Exception:
+            # Do not log the error message here as it may contain sensitive information such as login credentials.
+            LOGGER.error('Could not init Downloader for %s.', key)
+            return None
+        try:
+            # TODO: urllib3.connectionpool logs the URL in the DEBUG mode
+            LOGGER.debug('Downloading payments for %s.', key)
+            raw_statement = downloader.get_statement(start_date, end_date)
+        except Exception:
+            # Do not log the error message here as it may contain sensitive information such as login credentials.
+            LOGGER.error('Downloading payments for %s failed.', key)
+            return None
 
-            LOGGER.debug('Saving payments for %s.', key)
-            self.save_payments(payments)
+        LOGGER.debug('Parsing payments for %s.', key)
+        try:
+            return parser_class.parse_string(raw_statement)
+        except Exception as e:
+            LOGGER.error(str(e))
+            return None
 
-        LOGGER.info('Command download_payments finished.')
+    def _save_statement(self, key: str, statement: BankStatement) -> None:
+        payments = self._convert_to_models(statement)
+
+        LOGGER.debug('Saving payments for %s.', key)
+        self._update_watermark(key, self.save_payments(payments))
+
+    @staticmethod
+    def _get_incremental_start_dates(start_date: date, end_date: date, overlap: int) -> Dict[str, date]:
+        """Return start dates of the download interval based on download watermarks."""
+        watermarks = dict(DownloadWatermark.objects.filter(downloader__in=list(SETTINGS.downloaders)).values_list(
+            'downloader', 'transaction_date'))
+        start_dates = {}  # type: Dict[str, date]
+        for key in SETTINGS.downloaders:
+            if key in watermarks:
+                start_dates[key] = min(watermarks[key] - timedelta(days=overlap), end_date)
+            else:
+                start_dates[key] = start_date
+        return start_dates
+
+    @staticmethod
+    def _update_watermark(key: str, payments: Iterable[BankPayment]) -> None:
+        """Move download watermark to the date of the last downloaded transaction stored in database."""
+        dates = [payment.transaction_date for payment in payments if payment.transaction_date is not None]
+        if not dates:
+            return
+        last_date = max(dates)
+        watermark, created = DownloadWatermark.objects.get_or_create(downloader=key,
+                                                                     defaults={'transaction_date': last_date})
+        if not created and watermark.transaction_date < last_date:
+            watermark.transaction_date = last_date
+            watermark.save()
+
+    def _download_concurrently(self, start_dates: Dict[str, date], end_date: date, jobs: int) -> None:
+        """
+        Download and parse bank statements in a pool of threads.
+
+        Statements are saved in this thread as soon as they are downloaded, so database is accessed serially.
+        """
+        durations = OrderedDict((key, None) for key in SETTINGS.downloaders)  # type: Dict[str, Optional[float]]
+        results = {}  # type: Dict[str, str]
+
+        def timed_download(key, value):
+            started = monotonic()
+            try:
+                return self._download(key, value, start_dates[key], end_date)
+            finally:
+                durations[key] = monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = dict((pool.submit(timed_download, key, value), key)
+                           for key, value in SETTINGS.downloaders.items())
+            for future in as_completed(futures):
+                key = futures[future]
+                statement = future.result()
+                if statement is None:
+                    results[key] = 'failed'
+                else:
+                    results[key] = 'succeeded'
+                    self._save_statement(key, statement)
+
+        for key, duration in durations.items():
+            LOGGER.info('Downloader %s %s in %.3f seconds.', key, results.get(key, 'failed'), duration or 0)
 
     def _set_dates(self, start_date: Optional[date], end_date: Optional[date]) -> Tuple[date, date]:
         if end_date is None:
@@ -121,55 +212,64 @@ class Command(BaseCommand):
             payments.append(payment)
         return payments
 
-    def save_payments(self, payments: Iterable[BankPayment]) -> None:
-        """Save payments and related objects to database."""
+    def save_payments(self, payments: Iterable[BankPayment]) -> List[BankPayment]:
+        """
+        Save payments and related objects to database.
+
+        Payments which already exist are detected using one query. New payments are inserted using bulk insert.
+        Return payments which are stored in database, i.e. saved or already existing.
+        """
+        payments_list = list(payments)
+        existing = self._get_existing_keys(payments_list)
+        stored = set(existing)
         skipped = 0
-        for payment in payments:
+        new_payments = []
+        for payment in payments_list:
+            key = (payment.identifier, payment.account_id)
+            if key in existing:
+                skipped += 1
+                LOGGER.info('Payment ID %s already exists - skipping.', payment)
+                continue
             try:
-                skipped += self._save_if_not_exists(payment)
+                payment.full_clean(validate_unique=False)
+                for callback in SETTINGS.import_callbacks:
+                    payment = callback(payment)
             except ValidationError as error:
                 skipped += 1
-                message = 'Payment ID %s has not been saved due to the following errors:'
-                LOGGER.warning(message, payment.identifier)
-                if self.options['verbosity'] >= 1:
-                    self.stderr.write(self.style.WARNING(message % payment.identifier))
-
-                if hasattr(error, 'message_dict'):
-                    for field in error.message_dict:
-                        prefix = '{}: '.format(field) if field != '__all__' else ''
-                        for message in error.message_dict[field]:
-                            LOGGER.warning('%s%s', prefix, message)
-                            if self.options['verbosity'] >= 1:
-                                self.stderr.write(self.style.WARNING('%s%s' % (prefix, message)))
-                else:
-                    LOGGER.warning('\n'.join(error.messages))
-                    if self.options['verbosity'] >= 1:
-                        self.stderr.write(self.style.WARNING('\n'.join(error.messages)))
-            except IntegrityError as error:
-                skipped += 1
-                message = 'Payment ID %s has not been saved due to the following error: %s'
-                LOGGER.warning(message, payment.identifier, str(error))
-                if self.options['verbosity'] >= 1:
-                    self.stderr.write(self.style.WARNING(message % (payment.identifier, str(error))))
+                self._report_validation_error(payment, error)
             else:
-                if self.options['verbosity'] >= 2:
-                    self.stdout.write(self.style.SUCCESS('Payment ID {} has been imported.'.format(payment.identifier)))
+                existing.add(key)
+                new_payments.append(payment)
+
+        saved = self._insert_payments(new_payments)
+        skipped += len(new_payments) - len(saved)
         if skipped:
             LOGGER.info('Skipped %d payments.', skipped)
+        stored.update((payment.identifier, payment.account_id) for payment in saved)
+        return [payment for payment in payments_list if (payment.identifier, payment.account_id) in stored]
 
-    def _save_if_not_exists(self, payment: BankPayment) -> int:
-        """Return value is the number of skipped payments."""
-        with transaction.atomic():
-            if self._payment_exists(payment):
-                LOGGER.info('Payment ID %s already exists - skipping.', payment)
-                return 1
-            else:
-                payment.full_clean()
-                for callback in SETTINGS.import_callbacks:
-                    payment = callback(payment)
-                payment.save()
-                return 0
-
-    def _payment_exists(self, payment: BankPayment) -> bool:
-        query = BankPayment.objects.filter(account=payment.account, identifier=payment.identifier)
-        return query.exists()
+    def _insert_payments(self, payments: List[BankPayment]) -> List[BankPayment]:
+        """Insert new payments using bulk insert. Return value is the list of saved payments."""
+        if not payments:
+            return []
+        try:
+            with transaction.atomic():
+                BankPayment.objects.bulk_create(payments)
+        except IntegrityError:
+            # Some payment violates database constraints or it was saved in the meantime.
+            # Save payments one by one to find out which one.
+            saved = []
+            for payment in payments:
+                try:
+                    with transaction.atomic():
+                        payment.save()
+                except IntegrityError as error:
+                    self._report_integrity_error(payment, error)
+                else:
+                    saved.append(payment)
+                    self._report_imported(payment)
+            return saved
+        else:
+            for payment in payments:
+                self._report_imported(payment)
+            return payments
@@ -0,0 +1,92 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Command for reporting indexes used by queries of django_pain."""
+import logging
+import re
+import uuid
+from collections import OrderedDict
+from typing import List
+
+from django.core.management.base import BaseCommand, no_translations
+from django.db.models import QuerySet
+
+from django_pain.admin.filters import PaymentStateListFilter
+from django_pain.constants import PaymentState, PaymentType
+from django_pain.management.commands.process_payments import Command as ProcessPaymentsCommand
+from django_pain.models import BankPayment
+
+LOGGER = logging.getLogger(__name__)
+
+# Index names in PostgreSQL and SQLite query plans.
+INDEX_PATTERN = re.compile(r'(?:Scan(?: Backward)? using|Bitmap Index Scan on|USING (?:COVERING )?INDEX) "?(\w+)')
+
+# Number of rows of a page in admin and of a chunk in commands.
+PAGE_SIZE = 100
+
+
+def get_queries() -> 'OrderedDict[str, QuerySet]':
+    """Return queries of django_pain with the same shape as the queries run by the commands, API and admin."""
+    process_payments = ProcessPaymentsCommand.get_payments(
+        dict(time_from=None, time_to=None, include_accounts=None, exclude_accounts=None))
+    return OrderedDict([
+        ('process_payments', process_payments.order_by('transaction_date')),
+        ('process_payments card payments',
+         process_payments.filter(payment_type=PaymentType.CARD_PAYMENT).order_by('transaction_date')),
+        ('process_payments transfers',
+         process_payments.filter(payment_type=PaymentType.TRANSFER).order_by('transaction_date')),
+        ('process_payments chunk', process_payments.filter(pk__gt=0).order_by('pk').values('pk')[:PAGE_SIZE]),
+        ('get_card_payments_states',
+         BankPayment.objects.filter(state__in=[PaymentState.INITIALIZED]).order_by('create_time')),
+        ('download_payments existing payments',
+         BankPayment.objects.filter(account_id__in=[0], identifier__in=['']).values('identifier', 'account_id')),
+        ('list_payments',
+         BankPayment.objects.filter(state=PaymentState.PROCESSED).order_by('-create_time')[:PAGE_SIZE]),
+        ('REST API retrieve',
+         BankPayment.objects.filter(payment_type=PaymentType.CARD_PAYMENT, uuid=uuid.uuid4())),
+        ('admin changelist',
+         BankPayment.objects.filter(state__in=PaymentStateListFilter.REALIZED_STATES).order_by(
+             '-transaction_date', '-create_time', '-pk')[:PAGE_SIZE]),
+    ])
+
+
+def get_plan_indexes(plan: str) -> List[str]:
+    """Return names of indexes used in the query plan."""
+    indexes = []  # type: List[str]
+    for index in INDEX_PATTERN.findall(plan):
+        if index not in indexes:
+            indexes.append(index)
+    return indexes
+
+
+class Command(BaseCommand):
+    """Report indexes used by queries of django_pain."""
+
+    help = 'Report indexes used by queries of commands, REST API and admin using EXPLAIN.'
+
+    @no_translations
+    def handle(self, *args, **options):
+        """Run command."""
+        LOGGER.info('Command explain_queries started.')
+        for name, queryset in get_queries().items():
+            plan = queryset.explain()
+            indexes = get_plan_indexes(plan)
+            self.stdout.write('{}: {}'.format(name, ', '.join(indexes) if indexes else 'no index'))
+            if options['verbosity'] >= 2:
+                self.stdout.write(plan)
+        LOGGER.info('Command explain_queries finished.')
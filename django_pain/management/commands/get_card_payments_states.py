@@ -18,15 +18,19 @@
 
 """Command for updating states of card payments in non-final state."""
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from typing import Iterable, List
 
 from django.core.management.base import BaseCommand, no_translations
-from django.db import transaction
+from django.db import connections, transaction
 
-from django_pain.card_payment_handlers import PaymentHandlerConnectionError, PaymentHandlerError
-from django_pain.constants import PaymentState
+from django_pain.card_payment_handlers import PaymentHandlerConnectionError, PaymentStateResult
+from django_pain.constants import UPDATE_BATCH_SIZE, PaymentState
 from django_pain.models import BankPayment
 from django_pain.settings import get_card_payment_handler_instance
-from django_pain.utils import parse_datetime_safe
+from django_pain.utils import chunked, parse_datetime_safe, parse_positive_int
 
 LOGGER = logging.getLogger(__name__)
 
@@ -42,30 +46,99 @@ class Command(BaseCommand):
                             help="ISO datetime after which payments should be processed")
         parser.add_argument('-t', '--to', dest='time_to', type=parse_datetime_safe,
                             help="ISO datetime before which payments should be processed")
+        parser.add_argument('-j', '--jobs', type=parse_positive_int, default=None,
+                            help='get states of payments concurrently using given number of threads')
 
-    def _get_payments_states(self, payments):
-        """Get states of the payments using their card_payment_handler."""
+    @staticmethod
+    def _group_by_handler(payments) -> 'OrderedDict[str, List[BankPayment]]':
+        """Group the payments by their card_payment_handler."""
+        handler_payments = OrderedDict()  # type: OrderedDict[str, List[BankPayment]]
         for payment in payments:
-            try:
-                card_payment_handler = get_card_payment_handler_instance(payment.card_handler)
-                card_payment_handler.update_payments_state(payment)
-            except PaymentHandlerConnectionError:
-                LOGGER.error('Connection error while updating state of payment identifier=%s', payment.identifier)
-            except PaymentHandlerError:
-                LOGGER.error('Error while updating state of payment identifier=%s', payment.identifier)
+            handler_payments.setdefault(payment.card_handler, []).append(payment)
+        return handler_payments
+
+    @staticmethod
+    def _get_updated_payments(results: Iterable[PaymentStateResult]) -> List[BankPayment]:
+        """Return payments with successfully updated state and log errors of the others."""
+        updated_payments = []
+        for result in results:
+            if result.error is None:
+                updated_payments.append(result.payment)
+            elif isinstance(result.error, PaymentHandlerConnectionError):
+                LOGGER.error('Connection error while updating state of payment identifier=%s',
+                             result.payment.identifier)
+            else:
+                LOGGER.error('Error while updating state of payment identifier=%s', result.payment.identifier)
+        return updated_payments
+
+    def _get_payments_states(self, payments):
+        """
+        Get states of the payments using their card_payment_handler.
+
+        Payments are passed to their card payment handlers in batches and all changed payments are saved at once.
+        """
+        updated_payments = []  # type: List[BankPayment]
+        for card_handler, batch in self._group_by_handler(payments).items():
+            card_payment_handler = get_card_payment_handler_instance(card_handler)
+            updated_payments.extend(self._get_updated_payments(card_payment_handler.get_payments_states(batch)))
+        BankPayment.objects.bulk_update(updated_payments, ('state', 'card_payment_state'), batch_size=UPDATE_BATCH_SIZE)
+
+    def _get_payments_states_concurrently(self, payments, jobs: int) -> None:
+        """
+        Get states of the payments concurrently.
+
+        Only requests to card payment gateways run in `jobs` threads. Payments are not locked while waiting
+        for the gateways. Afterwards, payments which are still initialized and not locked by someone else
+        are updated at once in a single transaction.
+        """
+        payments = list(payments)
+        if not payments:
+            LOGGER.info('No payments to update state.')
+            return
+        LOGGER.info('Getting state of %s payment(s) using %s threads.', len(payments), jobs)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = []
+            for card_handler, batch in self._group_by_handler(payments).items():
+                for chunk in chunked(batch, ceil(len(batch) / jobs)):
+                    futures.append(pool.submit(self._get_chunk_states, card_handler, chunk))
+            updated_payments = []  # type: List[BankPayment]
+            for future in futures:
+                updated_payments.extend(self._get_updated_payments(future.result()))
+
+        with transaction.atomic():
+            # Skip payments locked or updated by someone else in the meantime.
+            unchanged = set(BankPayment.objects.select_for_update(skip_locked=True).filter(
+                pk__in=[payment.pk for payment in updated_payments], state=PaymentState.INITIALIZED,
+            ).values_list('pk', flat=True))
+            BankPayment.objects.bulk_update([payment for payment in updated_payments if payment.pk in unchanged],
+                                            ('state', 'card_payment_state'), batch_size=UPDATE_BATCH_SIZE)
+
+    @staticmethod
+    def _get_chunk_states(card_handler: str, payments: List[BankPayment]) -> List[PaymentStateResult]:
+        """Get states of the payments from the card payment gateway. Runs in a worker thread of concurrent mode."""
+        try:
+            return get_card_payment_handler_instance(card_handler).get_payments_states(payments)
+        finally:
+            # Handlers may access the database in the worker thread.
+            connections.close_all()
 
     @no_translations
     def handle(self, *args, **options):
         """Run the command."""
         LOGGER.info('Command get_card_payments_states started.')
+        payments = BankPayment.objects.filter(state__in=[PaymentState.INITIALIZED])
+        if options['time_from'] is not None:
+            payments = payments.filter(create_time__gte=options['time_from'])
+        if options['time_to'] is not None:
+            payments = payments.filter(create_time__lte=options['time_to'])
+        payments = payments.order_by('create_time')
+
+        if options['jobs'] is not None:
+            self._get_payments_states_concurrently(payments, options['jobs'])
+            return
+
         with transaction.atomic():
-            payments = BankPayment.objects.select_for_update(skip_locked=True)
-            payments = payments.filter(state__in=[PaymentState.INITIALIZED])
-            if options['time_from'] is not None:
-                payments = payments.filter(create_time__gte=options['time_from'])
-            if options['time_to'] is not None:
-                payments = payments.filter(create_time__lte=options['time_to'])
-            payments = payments.order_by('create_time')
+            payments = payments.select_for_update(skip_locked=True)
             if payments:
                 LOGGER.info('Getting state of %s payment(s).', payments.count())
                 self._get_payments_states(payments)
@@ -19,22 +19,45 @@
 """Command for importing payments from bank."""
 import logging
 import sys
-from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import IO, Iterable, List, NamedTuple, Sequence, Set, Tuple
 
-from django.core.exceptions import ValidationError
-from django.core.management.base import BaseCommand, CommandError, no_translations
-from django.db import transaction
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.core.management.base import CommandError, no_translations
+from django.db import connections, transaction
 from django.db.utils import IntegrityError
 from django.utils import module_loading
 
+from django_pain.management.commands._save_payments import SavePaymentsCommand
 from django_pain.models import BankAccount, BankPayment
 from django_pain.parsers.common import AbstractBankStatementParser
 from django_pain.settings import SETTINGS
+from django_pain.utils import chunked, close_connections_before_fork, parse_positive_int
 
 LOGGER = logging.getLogger(__name__)
 
+ImportStats = NamedTuple('ImportStats', [
+    ('parsed', int),
+    ('saved', int),
+    ('skipped', int),
+])
 
-class Command(BaseCommand):
+
+def _open_input(parser: AbstractBankStatementParser, input_file: str) -> IO:
+    """Open input file in the mode required by the parser, `-` stands for standard input."""
+    if input_file == '-':
+        return sys.stdin.buffer if parser.binary_input else sys.stdin
+    return open(input_file, 'rb' if parser.binary_input else 'r')
+
+
+def _parse_file(parser_path: str, input_file: str) -> List[BankPayment]:
+    """Parse payments from input file. Used in worker processes of parallel import."""
+    parser = module_loading.import_string(parser_path)()
+    with _open_input(parser, input_file) as handle:
+        return list(parser.parse(handle))
+
+
+class Command(SavePaymentsCommand):
     """Import payments from bank."""
 
     help = 'Import payments from the bank. Bank statement should be provided on standard input.'
@@ -42,6 +65,12 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         """Command takes one argument - dotted path to parser class."""
         parser.add_argument('-p', '--parser', type=str, required=True, help='dotted path to parser class')
+        parser.add_argument('-b', '--batch-size', type=parse_positive_int, default=None,
+                            help='save payments in batches of given size using bulk inserts')
+        parser.add_argument('-j', '--jobs', type=parse_positive_int, default=None,
+                            help='parse input files in parallel using given number of processes')
+        parser.add_argument('-w', '--writers', type=parse_positive_int, default=1,
+                            help='number of threads saving parsed payments to database, used with --jobs')
         parser.add_argument('input_file', nargs='*', type=str, default=['-'], help='input file with bank statement')
 
     @no_translations
@@ -55,18 +84,27 @@ class Command(BaseCommand):
             raise CommandError('Parser argument has to be subclass of AbstractBankStatementParser.')
         parser = parser_class()  # type: AbstractBankStatementParser
 
+        if options['jobs'] is not None:
+            self.import_parallel(options['parser'], options['input_file'], options['jobs'], options['writers'])
+            LOGGER.info('Command import_payments finished.')
+            return
+
         for input_file in options['input_file']:
             LOGGER.debug('Importing payments from %s.', input_file)
-            if input_file == '-':
-                handle = sys.stdin
-            else:
-                handle = open(input_file)
-
+            handle = _open_input(parser, input_file)
             try:
                 LOGGER.debug('Parsing payments from %s.', input_file)
-                payments = list(parser.parse(handle))
-                LOGGER.debug('Saving %s payments from %s to database.', len(payments), input_file)
-                self.save_payments(payments)
+                if options['batch_size']:
+                    # Parsing and saving is pipelined, only one batch of payments is held in memory.
+                    LOGGER.debug('Saving payments from %s to database in batches of %s.', input_file,
+                                 options['batch_size'])
+                    stats = self.save_payments_bulk(parser.parse(handle), options['batch_size'])
+                    LOGGER.info('Imported payments from %s: %s parsed, %s saved, %s skipped.', input_file,
+                                stats.parsed, stats.saved, stats.skipped)
+                else:
+                    payments = list(parser.parse(handle))
+                    LOGGER.debug('Saving %s payments from %s to database.', len(payments), input_file)
+                    self.save_payments(payments)
             except BankAccount.DoesNotExist as e:
                 LOGGER.error(str(e))
                 raise CommandError(e)
@@ -74,9 +112,59 @@ class Command(BaseCommand):
                 handle.close()
         LOGGER.info('Command import_payments finished.')
 
-    def save_payments(self, payments: Iterable[BankPayment]) -> None:
+    def import_parallel(self, parser_path: str, input_files: Sequence[str], jobs: int, writers: int) -> None:
+        """
+        Import payments from input files in parallel.
+
+        Files are parsed in a pool of `jobs` processes. Parsed payments are saved to database by a pool
+        of `writers` threads, each of them using its own database connection.
+        """
+        if '-' in input_files:
+            raise CommandError('Standard input can not be imported in parallel.')
+
+        close_connections_before_fork()
+        results = []
+        with ProcessPoolExecutor(max_workers=jobs) as parse_pool, ThreadPoolExecutor(max_workers=writers) as save_pool:
+            parse_futures = dict((parse_pool.submit(_parse_file, parser_path, input_file), input_file)
+                                 for input_file in input_files)
+            save_futures = []
+            for parse_future in as_completed(parse_futures):
+                input_file = parse_futures[parse_future]
+                try:
+                    payments = parse_future.result()
+                except BankAccount.DoesNotExist as e:
+                    for pending in parse_futures:
+                        pending.cancel()
+                    LOGGER.error(str(e))
+                    raise CommandError(e)
+                LOGGER.debug('Saving %s payments from %s to database.', len(payments), input_file)
+                save_futures.append(save_pool.submit(self._save_file, payments, input_file))
+            for save_future in save_futures:
+                results.append(save_future.result())
+
+        total = ImportStats(*(sum(counts) for counts in zip(*results))) if results else ImportStats(0, 0, 0)
+        LOGGER.info('Imported payments from %s files: %s parsed, %s saved, %s skipped.', len(results),
+                    total.parsed, total.saved, total.skipped)
+
+    def _save_file(self, payments: List[BankPayment], input_file: str) -> ImportStats:
+        """Save payments parsed from one file. Runs in a writer thread of parallel import."""
+        try:
+            if self.options['batch_size']:
+                stats = self.save_payments_bulk(payments, self.options['batch_size'])
+            else:
+                stats = self.save_payments(payments)
+            LOGGER.info('Imported payments from %s: %s parsed, %s saved, %s skipped.', input_file,
+                        stats.parsed, stats.saved, stats.skipped)
+            return stats
+        finally:
+            # Close database connection of the writer thread.
+            connections.close_all()
+
+    def save_payments(self, payments: Iterable[BankPayment]) -> ImportStats:
         """Save payments and related objects to database."""
+        parsed = saved = 0
         for payment in payments:
+            parsed += 1
             try:
                 with transaction.atomic():
                     payment.full_clean()
@@ -84,27 +172,81 @@ class Command(BaseCommand):
                         payment = callback(payment)
                     payment.save()
             except ValidationError as error:
-                message = 'Payment ID %s has not been saved due to the following errors:'
-                LOGGER.warning(message, payment.identifier)
-                if self.options['verbosity'] >= 1:
-                    self.stderr.write(self.style.WARNING(message % payment.identifier))
-
-                if hasattr(error, 'message_dict'):
-                    for field in error.message_dict:
-                        prefix = '{}: '.format(field) if field != '__all__' else ''
-                        for message in error.message_dict[field]:
-                            LOGGER.warning('%s%s', prefix, message)
-                            if self.options['verbosity'] >= 1:
-                                self.stderr.write(self.style.WARNING('%s%s' % (prefix, message)))
-                else:
-                    LOGGER.warning('\n'.join(error.messages))
-                    if self.options['verbosity'] >= 1:
-                        self.stderr.write(self.style.WARNING('\n'.join(error.messages)))
+                self._report_validation_error(payment, error)
             except IntegrityError as error:
-                message = 'Payment ID %s has not been saved due to the following error: %s'
-                LOGGER.warning(message, payment.identifier, str(error))
-                if self.options['verbosity'] >= 1:
-                    self.stderr.write(self.style.WARNING(message % (payment.identifier, str(error))))
+                self._report_integrity_error(payment, error)
             else:
-                if self.options['verbosity'] >= 2:
-                    self.stdout.write(self.style.SUCCESS('Payment ID {} has been imported.'.format(payment.identifier)))
+                saved += 1
+                self._report_imported(payment)
+        return ImportStats(parsed, saved, parsed - saved)
+
+    def save_payments_bulk(self, payments: Iterable[BankPayment], batch_size: int) -> ImportStats:
+        """
+        Save payments to database in batches.
+
+        Payments are consumed lazily, so each batch is saved as soon as it is parsed.
+        Payments are validated in memory, checked against already existing payments using one query per batch
+        and inserted using bulk inserts. Rejected payments are reported in the same way as in `save_payments`.
+        """
+        parsed = saved = 0
+        for batch in chunked(payments, batch_size):
+            parsed += len(batch)
+            saved += self._save_batch(batch)
+            LOGGER.debug('Import progress: %s parsed, %s saved, %s skipped.', parsed, saved, parsed - saved)
+        return ImportStats(parsed, saved, parsed - saved)
+
+    def _save_batch(self, batch: List[BankPayment]) -> int:
+        """Validate and insert one batch of payments. Return number of saved payments."""
+        existing = self._get_existing_keys(batch)
+        valid_payments = []
+        for payment in batch:
+            key = (payment.identifier, payment.account_id)
+            try:
+                self._clean_payment(payment, key in existing)
+                for callback in SETTINGS.import_callbacks:
+                    payment = callback(payment)
+            except ValidationError as error:
+                self._report_validation_error(payment, error)
+            else:
+                # Guard against duplicates within the batch as well.
+                existing.add(key)
+                valid_payments.append(payment)
+
+        if not valid_payments:
+            return 0
+        saved = len(valid_payments)
+        try:
+            with transaction.atomic():
+                # Insert rows in a stable order, so concurrent writers lock the unique keys in the same order.
+                BankPayment.objects.bulk_create(sorted(valid_payments,
+                                                       key=lambda payment: (payment.account_id, payment.identifier)))
+        except IntegrityError:
+            # Some payment was probably inserted in the meantime, insert the batch one by one to identify it.
+            LOGGER.debug('Bulk insert of %s payments failed, saving them one by one.', len(valid_payments))
+            for payment in valid_payments:
+                try:
+                    with transaction.atomic():
+                        payment.save()
+                except IntegrityError as error:
+                    saved -= 1
+                    self._report_integrity_error(payment, error)
+                else:
+                    self._report_imported(payment)
+        else:
+            for payment in valid_payments:
+                self._report_imported(payment)
+        return saved
+
+    @staticmethod
+    def _clean_payment(payment: BankPayment, exists: bool) -> None:
+        """Run the same validation as `full_clean` without querying database for uniqueness."""
+        errors = {}  # type: dict
+        try:
+            payment.full_clean(validate_unique=False)
+        except ValidationError as error:
+            errors = error.update_error_dict(errors)
+        if exists:
+            errors.setdefault(NON_FIELD_ERRORS, []).append(
+                payment.unique_error_message(BankPayment, ('identifier', 'account')))
+        if errors:
+            raise ValidationError(errors)
@@ -17,18 +17,25 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Command for processing bank payments."""
-import fcntl
 import logging
-from copy import deepcopy
+import multiprocessing
+from collections import OrderedDict
+from datetime import timedelta
 from itertools import zip_longest
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from django.core.management.base import BaseCommand, CommandError, no_translations
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import IntegerField, Q, QuerySet
+from django.db.models.functions import Mod
+from django.utils import module_loading, timezone
 
-from django_pain.constants import PaymentState, PaymentType
+from django_pain.constants import UPDATE_BATCH_SIZE, PaymentState, PaymentType
+from django_pain.locks import AbstractLock, LockError
 from django_pain.models import BankAccount, BankPayment
+from django_pain.processors import prepare_payments
 from django_pain.settings import SETTINGS, get_processor_instance
-from django_pain.utils import parse_datetime_safe
+from django_pain.utils import chunked, close_connections_before_fork, parse_datetime_safe, parse_positive_int
 
 LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +44,50 @@ class AccountDoesNotExist(Exception):
     """Account number does not exist."""
 
 
+def _acquire_lock(name: str) -> Optional[AbstractLock]:
+    """
+    Acquire lock of given name using PAIN_PROCESS_PAYMENTS_LOCK_BACKEND.
+
+    Return acquired lock or None if the lock is held by another process.
+    """
+    lock = module_loading.import_string(SETTINGS.process_payments_lock_backend)(name)  # type: AbstractLock
+    try:
+        if lock.acquire():
+            return lock
+    except LockError as error:
+        LOGGER.error('%s. Terminating.', str(error))
+        raise CommandError('{}. Terminating.'.format(error))
+    return None
+
+
+def _process_shard(filters: Dict[str, Any], chunk_size: Optional[int], shard: int, shards: int,
+                   concurrent: bool = False) -> bool:
+    """
+    Process payments of one shard. Runs in a worker process of sharded processing.
+
+    Each shard has its own lock, unless `concurrent` is set, so workers left behind by a killed run
+    do not process the same shard. Return False if the shard is locked by another process.
+    """
+    try:
+        lock = None
+        if not concurrent:
+            lock = _acquire_lock('{}.{}.{}'.format(SETTINGS.process_payments_lock_file, shards, shard))
+            if lock is None:
+                return False
+        try:
+            LOGGER.info('Processing shard %s.', shard)
+            payments = Command.get_payments(filters).annotate(
+                shard=Mod('account_id', shards, output_field=IntegerField())).filter(shard=shard)
+            Command._process_selected(payments, chunk_size)
+        finally:
+            if lock is not None:
+                lock.release()
+    finally:
+        # Close database connection of the worker process.
+        connections.close_all()
+    return True
+
+
 class Command(BaseCommand):
     """Process bank payments."""
 
@@ -53,6 +104,12 @@ class Command(BaseCommand):
                            help='Comma separated list of account numbers that should be included')
         group.add_argument('--exclude-accounts', type=(lambda x: set(x.split(','))),
                            help='Comma separated list of account numbers that should be excluded')
+        parser.add_argument('-c', '--chunk-size', type=parse_positive_int, default=None,
+                            help='process payments in separate transactions of given number of payments')
+        parser.add_argument('-j', '--jobs', type=parse_positive_int, default=None,
+                            help='process payments in given number of worker processes, sharded by bank account')
+        parser.add_argument('--concurrent', action='store_true',
+                            help='do not prevent concurrent runs, payments are shared using row locks')
 
     @staticmethod
     def _check_accounts_existence(account_numbers):
@@ -64,6 +121,40 @@ class Command(BaseCommand):
             raise AccountDoesNotExist('Following accounts do not exist: %s. Terminating.'
                                       % ', '.join(non_existing_accounts))
 
+    @staticmethod
+    def _save_payments(payments: Iterable[BankPayment], fields: Sequence[str]) -> None:
+        """
+        Save given fields of payments.
+
+        Payments are grouped by values of the fields, so only one UPDATE query is needed for each group
+        of payments (split into batches of UPDATE_BATCH_SIZE payments).
+        """
+        groups = OrderedDict()  # type: Dict[Tuple, List[int]]
+        for payment in payments:
+            key = tuple(getattr(payment, field) for field in fields)
+            groups.setdefault(key, []).append(payment.pk)
+        for values, pks in groups.items():
+            for batch in chunked(pks, UPDATE_BATCH_SIZE):
+                BankPayment.objects.filter(pk__in=batch).update(**dict(zip(fields, values)))
+
+    @staticmethod
+    def _schedule_retry(payments: Iterable[BankPayment]) -> None:
+        """
+        Schedule the next processing attempt of deferred payments.
+
+        The delay before the next attempt starts at PAIN_PROCESS_PAYMENTS_RETRY_DELAY
+        and doubles with each attempt up to PAIN_PROCESS_PAYMENTS_MAX_RETRY_DELAY.
+        """
+        now = timezone.now()
+        for payment in payments:
+            if payment.state != PaymentState.DEFERRED:
+                continue
+            payment.processing_attempts += 1
+            if SETTINGS.process_payments_retry_delay:
+                delay = min(SETTINGS.process_payments_retry_delay * 2 ** (payment.processing_attempts - 1),
+                            SETTINGS.process_payments_max_retry_delay)
+                payment.next_processing_time = now + timedelta(seconds=delay)
+
     @staticmethod
     def _process_transfer_payments(payments):
         """Process the payments made by bank transfer."""
@@ -73,30 +164,35 @@ class Command(BaseCommand):
                 break
 
             LOGGER.info('Processing payments with processor %s.', processor_name)
-            results = processor.process_payments(deepcopy(payment) for payment in payments)
+            results = processor.process_payments(prepare_payments(processor, payments))
             unprocessed_payments = []
+            changed_payments = []
 
             for payment, processed in zip_longest(payments, results):
                 if processed.result:
                     payment.state = PaymentState.PROCESSED
                     payment.processor = processor_name
                     payment.processing_error = processed.error
-                    payment.save()
+                    changed_payments.append(payment)
                 elif processed.error is not None:
                     LOGGER.info('Saving payment %s as DEFERRED with error %s.', payment.uuid, processed.error)
                     payment.state = PaymentState.DEFERRED
                     payment.processor = processor_name
                     payment.processing_error = processed.error
-                    payment.save()
+                    changed_payments.append(payment)
                 else:
                     unprocessed_payments.append(payment)
 
+            Command._schedule_retry(changed_payments)
+            Command._save_payments(changed_payments, ('state', 'processor', 'processing_error', 'processing_attempts',
+                                                      'next_processing_time'))
             payments = unprocessed_payments
 
         LOGGER.info('Marking %s unprocessed payments as DEFERRED.', len(payments))
         for unprocessed_payment in payments:
             unprocessed_payment.state = PaymentState.DEFERRED
-            unprocessed_payment.save()
+        Command._schedule_retry(payments)
+        Command._save_payments(payments, ('state', 'processing_attempts', 'next_processing_time'))
 
     @staticmethod
     def _process_card_payments(payments):
@@ -113,19 +209,128 @@ class Command(BaseCommand):
             processors_payments = payments.filter(processor=processor_name)
 
             LOGGER.info('Processing card payments with processor %s.', processor_name)
-            results = processor.process_payments(
-                deepcopy(payment) for payment in processors_payments)
+            results = processor.process_payments(prepare_payments(processor, processors_payments))
+            changed_payments = []
 
             for payment, processed in zip_longest(processors_payments, results):
                 if processed.result:
                     payment.state = PaymentState.PROCESSED
                     payment.processing_error = processed.error
-                    payment.save()
                 else:
                     LOGGER.info('Saving payment %s as DEFERRED with error %s.', payment.uuid, processed.error)
                     payment.state = PaymentState.DEFERRED
                     payment.processing_error = processed.error
-                    payment.save()
+                changed_payments.append(payment)
+
+            Command._schedule_retry(changed_payments)
+            Command._save_payments(changed_payments, ('state', 'processing_error', 'processing_attempts',
+                                                      'next_processing_time'))
+
+    @staticmethod
+    def _process_payments(payments):
+        """Process card payments and transfer payments."""
+        Command._process_card_payments(payments.filter(payment_type=PaymentType.CARD_PAYMENT))
+        Command._process_transfer_payments(payments.filter(payment_type=PaymentType.TRANSFER))
+
+    @staticmethod
+    def _process_chunks(payments, chunk_size: int) -> None:
+        """
+        Process payments in chunks, each of them in its own transaction.
+
+        Payments are iterated by primary key. Only the payments of the current chunk are locked,
+        so the row locks are held for a short time only.
+        """
+        LOGGER.info('Processing unprocessed payments in chunks of %s payments.', chunk_size)
+        last_pk = 0
+        total = 0
+        while True:
+            with transaction.atomic():
+                chunk = payments.select_for_update(skip_locked=True).filter(pk__gt=last_pk).order_by('pk')
+                pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+                if not pks:
+                    break
+                last_pk = pks[-1]
+                total += len(pks)
+                LOGGER.info('Processing chunk of %s unprocessed payments.', len(pks))
+                Command._process_payments(BankPayment.objects.filter(pk__in=pks).order_by('transaction_date', 'pk'))
+        LOGGER.info('Processed %s unprocessed payments.', total)
+
+    @staticmethod
+    def get_payments(filters: Dict[str, Any]) -> QuerySet:
+        """
+        Return payments which should be processed.
+
+        Filters contain `time_from`, `time_to`, `include_accounts` and `exclude_accounts` options of the command.
+        """
+        # Deferred payments are processed only once their retry delay elapses.
+        payments = BankPayment.objects.filter(
+            Q(state=PaymentState.READY_TO_PROCESS)
+            | Q(state=PaymentState.DEFERRED, next_processing_time__isnull=True)
+            | Q(state=PaymentState.DEFERRED, next_processing_time__lte=timezone.now()))
+        if filters['time_from'] is not None:
+            payments = payments.filter(create_time__gte=filters['time_from'])
+        if filters['time_to'] is not None:
+            payments = payments.filter(create_time__lte=filters['time_to'])
+        if filters['include_accounts']:
+            Command._check_accounts_existence(filters['include_accounts'])
+            payments = payments.filter(account__account_number__in=filters['include_accounts'])
+        if filters['exclude_accounts']:
+            Command._check_accounts_existence(filters['exclude_accounts'])
+            payments = payments.exclude(account__account_number__in=filters['exclude_accounts'])
+        return payments
+
+    @staticmethod
+    def _process_selected(payments: QuerySet, chunk_size: Optional[int]) -> None:
+        """Process selected payments either in one transaction or in chunks."""
+        if chunk_size:
+            Command._process_chunks(payments, chunk_size)
+        else:
+            with transaction.atomic():
+                payments = payments.select_for_update(skip_locked=True).order_by('transaction_date')
+
+                LOGGER.info('Processing %s unprocessed payments.', payments.count())
+
+                Command._process_payments(payments)
+
+    def _acquire_command_lock(self) -> Optional[AbstractLock]:
+        """Acquire the lock of the command. Display warning and return None if it is held by another process."""
+        lock = _acquire_lock(SETTINGS.process_payments_lock_file)
+        if lock is None:
+            self.stderr.write(self.style.WARNING('Command process_payments is already running. Terminating.'))
+            LOGGER.warning('Command already running. Terminating.')
+        else:
+            LOGGER.info('Lock acquired.')
+        return lock
+
+    def _process_shards(self, filters: Dict[str, Any], chunk_size: Optional[int], shards: int,
+                        concurrent: bool) -> bool:
+        """
+        Process payments split into shards by bank account, each shard in its own worker process.
+
+        The lock of the command is held by this process, unless `concurrent` is set.
+        Return False if the lock is held by another process.
+        """
+        LOGGER.info('Processing payments in %s shards.', shards)
+        # Workers are started before the lock is acquired, so they do not share the connection holding an advisory lock.
+        close_connections_before_fork()
+        with multiprocessing.Pool(processes=shards) as pool:
+            lock = None
+            if not concurrent:
+                lock = self._acquire_command_lock()
+                if lock is None:
+                    return False
+            try:
+                results = pool.starmap(_process_shard, [(filters, chunk_size, shard, shards, concurrent)
+                                                        for shard in range(shards)])
+            finally:
+                if lock is not None:
+                    lock.release()
+        for shard, processed in enumerate(results):
+            if not processed:
+                self.stderr.write(self.style.WARNING(
+                    'Shard {} of command process_payments is already being processed. Skipping.'.format(shard)))
+                LOGGER.warning('Shard %s already being processed. Skipping.', shard)
+        return True
 
     @no_translations
     def handle(self, *args, **options):
@@ -135,50 +340,30 @@ class Command(BaseCommand):
         If can't acquire lock, display warning and terminate.
         """
         LOGGER.info('Command process_payments started.')
-        LOCK = None
-        try:
-            LOCK = open(SETTINGS.process_payments_lock_file, 'a')
-            fcntl.flock(LOCK, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            LOGGER.info('Lock acquired.')
-        except OSError as error:
-            if LOCK is not None:
-                self.stderr.write(self.style.WARNING('Command process_payments is already running. Terminating.'))
-                LOCK.close()
-                LOGGER.warning('Command already running. Terminating.')
+        filters = dict((key, options[key]) for key in ('time_from', 'time_to', 'include_accounts', 'exclude_accounts'))
+        if options['jobs'] is not None:
+            try:
+                # Check the filters before the workers are started.
+                self.get_payments(filters)
+            except AccountDoesNotExist as e:
+                LOGGER.error(str(e))
+                raise CommandError(str(e))
+            if self._process_shards(filters, options['chunk_size'], options['jobs'], options['concurrent']):
+                LOGGER.info('Command process_payments finished.')
+            return
+
+        lock = None
+        if not options['concurrent']:
+            lock = self._acquire_command_lock()
+            if lock is None:
                 return
-            else:
-                LOGGER.error(
-                    'Error occured while opening lockfile %s: %s. Terminating.',
-                    SETTINGS.process_payments_lock_file, str(error)
-                )
-                raise CommandError('Error occured while opening lockfile {}: {}. Terminating.'.format(
-                    SETTINGS.process_payments_lock_file, str(error)))
 
         try:
-            with transaction.atomic():
-                payments = BankPayment.objects.select_for_update(skip_locked=True)
-                payments = payments.filter(state__in=[PaymentState.READY_TO_PROCESS, PaymentState.DEFERRED])
-                if options['time_from'] is not None:
-                    payments = payments.filter(create_time__gte=options['time_from'])
-                if options['time_to'] is not None:
-                    payments = payments.filter(create_time__lte=options['time_to'])
-                if options['include_accounts']:
-                    self._check_accounts_existence(options['include_accounts'])
-                    payments = payments.filter(account__account_number__in=options['include_accounts'])
-                if options['exclude_accounts']:
-                    self._check_accounts_existence(options['exclude_accounts'])
-                    payments = payments.exclude(account__account_number__in=options['exclude_accounts'])
-                payments = payments.order_by('transaction_date')
-
-                LOGGER.info('Processing %s unprocessed payments.', payments.count())
-
-                self._process_card_payments(payments.filter(payment_type=PaymentType.CARD_PAYMENT))
-                self._process_transfer_payments(payments.filter(payment_type=PaymentType.TRANSFER))
-
+            self._process_selected(self.get_payments(filters), options['chunk_size'])
         except AccountDoesNotExist as e:
             LOGGER.error(str(e))
             raise CommandError(str(e))
         finally:
-            fcntl.flock(LOCK, fcntl.LOCK_UN)
-            LOCK.close()
+            if lock is not None:
+                lock.release()
         LOGGER.info('Command process_payments finished.')
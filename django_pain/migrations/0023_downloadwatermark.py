@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_pain', '0022_auto_20200804_1122'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('downloader', models.TextField(unique=True, verbose_name='Downloader')),
+                ('transaction_date', models.DateField(verbose_name='Transaction date')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='Update time')),
+            ],
+            options={
+                'verbose_name': 'Download watermark',
+                'verbose_name_plural': 'Download watermarks',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.16 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_pain', '0023_downloadwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bankpayment',
+            name='next_processing_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Next processing time'),
+        ),
+        migrations.AddField(
+            model_name='bankpayment',
+            name='processing_attempts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Processing attempts'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Admin search uses `icontains` lookups, which are `UPPER(column::text) LIKE UPPER(%s)` on PostgreSQL.
+# Trigram indexes on the same expressions are used by these queries.
+SEARCH_INDEXES = (
+    ('django_pain_bankpayment_variable_symbol_trgm', 'variable_symbol'),
+    ('django_pain_bankpayment_counter_account_name_trgm', 'counter_account_name'),
+    ('django_pain_bankpayment_description_trgm', 'description'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON django_pain_bankpayment '
+            'USING gin (UPPER({}::text) gin_trgm_ops)'.format(name, column))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, which is not possible in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('django_pain', '0024_processing_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, reverse_code=drop_search_indexes),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+import django_pain.constants
+
+INDEXES = [
+    models.Index(fields=['state', 'create_time'], name='bankpayment_state_time_idx'),
+    models.Index(condition=models.Q(state__in=[django_pain.constants.PaymentState('ready_to_process'),
+                                               django_pain.constants.PaymentState('deferred')]),
+                 fields=['payment_type', 'transaction_date'], name='bankpayment_unprocessed_idx'),
+    models.Index(condition=models.Q(state=django_pain.constants.PaymentState('initialized')),
+                 fields=['create_time'], name='bankpayment_initialized_idx'),
+    models.Index(fields=['-transaction_date', '-create_time'], name='bankpayment_admin_order_idx'),
+]
+
+
+def add_indexes(apps, schema_editor):
+    BankPayment = apps.get_model('django_pain', 'BankPayment')
+    for index in INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            # Build indexes without blocking writes to the table.
+            sql = str(index.create_sql(BankPayment, schema_editor))
+            schema_editor.execute(sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
+        else:
+            schema_editor.add_index(BankPayment, index)
+
+
+def remove_indexes(apps, schema_editor):
+    BankPayment = apps.get_model('django_pain', 'BankPayment')
+    for index in INDEXES:
+        schema_editor.remove_index(BankPayment, index)
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are created concurrently, which is not possible in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('django_pain', '0025_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_indexes, reverse_code=remove_indexes)],
+            state_operations=[migrations.AddIndex(model_name='bankpayment', index=index) for index in INDEXES],
+        ),
+    ]
@@ -17,8 +17,10 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Models module."""
-from .bank import PAYMENT_STATE_CHOICES, BankAccount, BankPayment
+from .bank import PAYMENT_STATE_CHOICES, AccountSnapshot, BankAccount, BankPayment, PaymentSnapshot
 from .client import Client
+from .download import DownloadWatermark
 from .invoices import Invoice
 
-__all__ = ['PAYMENT_STATE_CHOICES', 'BankAccount', 'BankPayment', 'Client', 'Invoice']
+__all__ = ['PAYMENT_STATE_CHOICES', 'AccountSnapshot', 'BankAccount', 'BankPayment', 'Client', 'DownloadWatermark',
+           'Invoice', 'PaymentSnapshot']
@@ -18,13 +18,15 @@
 
 """Payments and invoices models."""
 import uuid
-from typing import Optional
+from datetime import date, datetime
+from typing import NamedTuple, Optional
 
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import BLANK_CHOICE_DASH, CheckConstraint, Q
+from django.db.models import BLANK_CHOICE_DASH, CheckConstraint, Index, Q
 from django.utils.translation import gettext_lazy as _
 from djmoney.models.fields import CurrencyField, MoneyField
+from djmoney.money import Money
 from teller.statement import Payment
 
 from django_pain.constants import CURRENCY_PRECISION, InvoiceType, PaymentProcessingError, PaymentState, PaymentType
@@ -53,6 +55,38 @@ PROCESSING_ERROR_CHOICES = (
     (PaymentProcessingError.TOO_OLD, _("Payment is older than 15 days, it can't be processed automatically")),
 )
 
+AccountSnapshot = NamedTuple('AccountSnapshot', [
+    ('pk', int),
+    ('account_number', str),
+    ('account_name', str),
+    ('currency', str),
+])
+
+# Read-only copy of the bank payment, see `BankPayment.get_snapshot`.
+PaymentSnapshot = NamedTuple('PaymentSnapshot', [
+    ('pk', int),
+    ('identifier', str),
+    ('uuid', uuid.UUID),
+    ('payment_type', str),
+    ('account', AccountSnapshot),
+    ('create_time', datetime),
+    ('transaction_date', Optional[date]),
+    ('counter_account_number', str),
+    ('counter_account_name', str),
+    ('amount', Money),
+    ('description', str),
+    ('state', str),
+    ('card_payment_state', str),
+    ('processing_error', Optional[str]),
+    ('processing_attempts', int),
+    ('next_processing_time', Optional[datetime]),
+    ('constant_symbol', str),
+    ('variable_symbol', str),
+    ('specific_symbol', str),
+    ('processor', str),
+    ('card_handler', str),
+])
+
 
 class BankAccount(models.Model):
     """Bank account."""
@@ -71,6 +105,11 @@ class BankAccount(models.Model):
         """Return string representation of bank account."""
         return '{} {}'.format(self.account_name, self.account_number)
 
+    def get_snapshot(self) -> AccountSnapshot:
+        """Return read-only copy of the bank account."""
+        return AccountSnapshot(pk=self.pk, account_number=self.account_number, account_name=self.account_name,
+                               currency=self.currency)
+
 
 class BankPayment(models.Model):
     """Bank payment."""
@@ -94,6 +133,11 @@ class BankPayment(models.Model):
 
     processing_error = models.TextField(choices=PROCESSING_ERROR_CHOICES, null=True, blank=True,
                                         verbose_name=_('Automatic processing error'))
+    # Number of unsuccessful attempts of automatic processing and time of the next one.
+    processing_attempts = models.PositiveIntegerField(default=0, editable=False,
+                                                      verbose_name=_('Processing attempts'))
+    next_processing_time = models.DateTimeField(null=True, blank=True, editable=False,
+                                                verbose_name=_('Next processing time'))
 
     # Payment symbols (specific for Czech Republic and Slovak Republic).
     constant_symbol = models.CharField(max_length=10, blank=True, verbose_name=_('Constant symbol'))
@@ -116,6 +160,19 @@ class BankPayment(models.Model):
                             name='payment_counter_account_only_for_transfer')
         ]
 
+        indexes = [
+            # list_payments and filters of payment commands
+            Index(fields=['state', 'create_time'], name='bankpayment_state_time_idx'),
+            # process_payments
+            Index(fields=['payment_type', 'transaction_date'], name='bankpayment_unprocessed_idx',
+                  condition=Q(state__in=[PaymentState.READY_TO_PROCESS, PaymentState.DEFERRED])),
+            # get_card_payments_states
+            Index(fields=['create_time'], name='bankpayment_initialized_idx',
+                  condition=Q(state=PaymentState.INITIALIZED)),
+            # admin changelist ordering
+            Index(fields=['-transaction_date', '-create_time'], name='bankpayment_admin_order_idx'),
+        ]
+
     def __str__(self):
         """Return string representation of bank payment."""
         return self.identifier
@@ -128,6 +185,39 @@ class BankPayment(models.Model):
             ))
         super().clean()
 
+    def get_snapshot(self, account: Optional[AccountSnapshot] = None) -> PaymentSnapshot:
+        """
+        Return read-only copy of the payment.
+
+        Snapshot is much cheaper than a deep copy of the payment. Snapshot of the bank account may be provided,
+        so it can be shared by snapshots of many payments.
+        """
+        if account is None:
+            account = self.account.get_snapshot()
+        return PaymentSnapshot(
+            pk=self.pk,
+            identifier=self.identifier,
+            uuid=self.uuid,
+            payment_type=self.payment_type,
+            account=account,
+            create_time=self.create_time,
+            transaction_date=self.transaction_date,
+            counter_account_number=self.counter_account_number,
+            counter_account_name=self.counter_account_name,
+            amount=self.amount,
+            description=self.description,
+            state=self.state,
+            card_payment_state=self.card_payment_state,
+            processing_error=self.processing_error,
+            processing_attempts=self.processing_attempts,
+            next_processing_time=self.next_processing_time,
+            constant_symbol=self.constant_symbol,
+            variable_symbol=self.variable_symbol,
+            specific_symbol=self.specific_symbol,
+            processor=self.processor,
+            card_handler=self.card_handler,
+        )
+
     @property
     def advance_invoice(self):
         """Return advance invoice if it exists."""
@@ -0,0 +1,46 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Payment download related models."""
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class DownloadWatermark(models.Model):
+    """
+    Download watermark.
+
+    Fields:
+        downloader          name of the downloader in PAIN_DOWNLOADERS setting
+        transaction_date    date of the last downloaded transaction
+        update_time         time of the last update of the watermark
+    """
+
+    downloader = models.TextField(unique=True, verbose_name=_('Downloader'))
+    transaction_date = models.DateField(verbose_name=_('Transaction date'))
+    update_time = models.DateTimeField(auto_now=True, verbose_name=_('Update time'))
+
+    class Meta:
+        """Model Meta class."""
+
+        verbose_name = _('Download watermark')
+        verbose_name_plural = _('Download watermarks')
+
+    def __str__(self):
+        """Return string representation of download watermark."""
+        return '{} {}'.format(self.downloader, self.transaction_date)
@@ -24,7 +24,13 @@ from django_pain.models import BankPayment
 
 
 class AbstractBankStatementParser(ABC):
-    """Bank statement parser."""
+    """
+    Bank statement parser.
+
+    Bank statements are provided to parsers in text mode, unless the parser sets `binary_input` to True.
+    """
+
+    binary_input = False
 
     @abstractmethod
     def parse(self, bank_statement: IO) -> Iterable[BankPayment]:
@@ -25,7 +25,7 @@ transforming them into unified XML format.
 URL: https://github.com/CZ-NIC/fred-transproc
 """
 from datetime import datetime
-from typing import IO, Iterator
+from typing import IO, Dict, Iterator, Optional
 
 from djmoney.money import Money
 from lxml import etree
@@ -43,40 +43,117 @@ def none_to_str(value: str) -> str:
 class TransprocXMLParser(CzechSlovakBankStatementParser):
     """Transproc XML parser."""
 
+    # XML declares its own encoding.
+    binary_input = True
+
     def parse(self, bank_statement: IO[bytes]) -> Iterator[BankPayment]:
         """Parse XML input."""
         parser = etree.XMLParser(resolve_entities=False)
         tree = etree.parse(bank_statement, parser)
 
-        account_number = self.compose_account_number(tree.find('//*/account_number').text,
-                                                     tree.find('//*/account_bank_code').text)
+        account = self.get_account(tree.find('//*/account_number').text, tree.find('//*/account_bank_code').text)
+
+        for item in tree.findall('//*/*/item'):
+            payment = self.parse_item(item, account)
+            if payment is not None:
+                yield payment
+
+    def get_account(self, number: str, bank_code: str) -> BankAccount:
+        """Return bank account of the statement."""
+        account_number = self.compose_account_number(number, bank_code)
         try:
-            account = BankAccount.objects.get(account_number=account_number)
+            return BankAccount.objects.get(account_number=account_number)
         except BankAccount.DoesNotExist:
             raise BankAccount.DoesNotExist('Bank account {} does not exist.'.format(account_number))
 
-        for item in tree.findall('//*/*/item'):
-            attrs = dict((el.tag, el.text) for el in item.iterchildren())
-
-            if attrs.get('status', '1') == '1' and attrs.get('code', '1') == '1' and attrs.get('type', '1') == '1':
-                # Only import payments with code==1 (normal transaction) and status==1 (realized transfer)
-                if SETTINGS.trim_varsym:
-                    variable_symbol = none_to_str(attrs['var_symbol']).lstrip('0')
-                else:
-                    variable_symbol = none_to_str(attrs['var_symbol'])
-
-                payment = BankPayment(
-                    identifier=attrs['ident'],
-                    account=account,
-                    transaction_date=datetime.strptime(attrs['date'], '%Y-%m-%d'),
-                    counter_account_number=self.compose_account_number(attrs['account_number'],
-                                                                       attrs['account_bank_code']),
-                    counter_account_name=none_to_str(attrs['name']),
-                    amount=Money(attrs['price'], account.currency),
-                    description=none_to_str(attrs['memo']),
-                    constant_symbol=none_to_str(attrs['const_symbol']),
-                    variable_symbol=variable_symbol,
-                    specific_symbol=none_to_str(attrs['spec_symbol']),
-                )
+    def parse_item(self, item: etree._Element, account: BankAccount) -> Optional[BankPayment]:
+        """Return payment parsed from statement item or None if the item should not be imported."""
+        attrs = dict((el.tag, el.text) for el in item.iterchildren())
 
-                yield payment
+        if attrs.get('status', '1') == '1' and attrs.get('code', '1') == '1' and attrs.get('type', '1') == '1':
+            # Only import payments with code==1 (normal transaction) and status==1 (realized transfer)
+            if SETTINGS.trim_varsym:
+                variable_symbol = none_to_str(attrs['var_symbol']).lstrip('0')
+            else:
+                variable_symbol = none_to_str(attrs['var_symbol'])
+
+            return BankPayment(
+                identifier=attrs['ident'],
+                account=account,
+                transaction_date=datetime.strptime(attrs['date'], '%Y-%m-%d'),
+                counter_account_number=self.compose_account_number(attrs['account_number'],
+                                                                   attrs['account_bank_code']),
+                counter_account_name=none_to_str(attrs['name']),
+                amount=Money(attrs['price'], account.currency),
+                description=none_to_str(attrs['memo']),
+                constant_symbol=none_to_str(attrs['const_symbol']),
+                variable_symbol=variable_symbol,
+                specific_symbol=none_to_str(attrs['spec_symbol']),
+            )
+        return None
+
+
+class TransprocXMLStreamParser(TransprocXMLParser):
+    """
+    Streaming Transproc XML parser.
+
+    Payments are yielded as soon as their ``item`` element is parsed and processed elements are discarded.
+    Memory consumption therefore does not depend on the size of the bank statement.
+    Bank statement may be read both in binary and text mode.
+    """
+
+    HEADER_TAGS = ('account_number', 'account_bank_code')
+    CHUNK_SIZE = 64 * 1024
+
+    def parse(self, bank_statement: IO) -> Iterator[BankPayment]:
+        """Parse XML input incrementally."""
+        header = {}  # type: Dict[str, str]
+        account = None  # type: Optional[BankAccount]
+
+        for element in self._iter_elements(bank_statement):
+            depth = self._get_depth(element)
+            if element.tag == 'item':
+                if depth < 3:
+                    continue
+                if account is None:
+                    account = self.get_account(header.get('account_number', ''), header.get('account_bank_code', ''))
+                payment = self.parse_item(element, account)
+                if payment is not None:
+                    yield payment
+                self._discard(element)
+            elif depth >= 2 and element.tag not in header:
+                # Use the first occurence of the header tags, the same way as `TransprocXMLParser` does.
+                header[element.tag] = element.text
+                if account is None and len(header) == len(self.HEADER_TAGS):
+                    account = self.get_account(header['account_number'], header['account_bank_code'])
+
+    def _iter_elements(self, bank_statement: IO) -> Iterator[etree._Element]:
+        """Yield parsed header and item elements, the input is fed to the parser in chunks."""
+        parser = etree.XMLPullParser(events=('end',), tag=self.HEADER_TAGS + ('item',), resolve_entities=False)
+        chunk = bank_statement.read(self.CHUNK_SIZE)
+        while chunk:
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                yield element
+            chunk = bank_statement.read(self.CHUNK_SIZE)
+        parser.close()
+        for _, element in parser.read_events():
+            yield element
+
+    @staticmethod
+    def _get_depth(element: etree._Element) -> int:
+        """Return depth of the element, root element has depth 0."""
+        depth = 0
+        parent = element.getparent()
+        while parent is not None:
+            depth += 1
+            parent = parent.getparent()
+        return depth
+
+    @staticmethod
+    def _discard(element: etree._Element) -> None:
+        """Free the processed element and its already processed siblings."""
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
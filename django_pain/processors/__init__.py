@@ -17,7 +17,7 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Processors module."""
-from .common import AbstractPaymentProcessor, InvalidTaxDateError, ProcessPaymentResult
+from .common import AbstractPaymentProcessor, InvalidTaxDateError, ProcessPaymentResult, prepare_payments
 from .ignore import IgnorePaymentProcessor
 
 __all__ = [
@@ -25,4 +25,5 @@ __all__ = [
     'InvalidTaxDateError',
     'ProcessPaymentResult',
     'IgnorePaymentProcessor',
+    'prepare_payments',
 ]
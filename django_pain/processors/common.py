@@ -18,10 +18,11 @@
 
 """Base payment processor module."""
 from abc import ABC, abstractmethod
-from typing import Iterable
+from copy import deepcopy
+from typing import Iterable, Iterator, Union
 
 from django_pain.constants import PaymentProcessingError
-from django_pain.models import BankPayment
+from django_pain.models import BankPayment, PaymentSnapshot
 
 
 class InvalidTaxDateError(Exception):
@@ -83,6 +84,18 @@ class AbstractPaymentProcessor(ABC):
         """
         return False
 
+    @property
+    def use_payment_snapshots(self):
+        """
+        Return whether payment processor accepts payment snapshots in `process_payments`.
+
+        If True, payments are passed to `process_payments` as read-only `PaymentSnapshot` objects.
+        Otherwise, deep copies of `BankPayment` objects are passed.
+
+        Default is False.
+        """
+        return False
+
     @abstractmethod
     def process_payments(self, payments: Iterable[BankPayment]) -> Iterable[ProcessPaymentResult]:
         """
@@ -107,3 +120,22 @@ class AbstractPaymentProcessor(ABC):
         For processors where manual_tax_date=True, optional attr tax_date is
         also provided. In that case, this method may raise InvalidTaxDateError.
         """
+
+
+def prepare_payments(processor: AbstractPaymentProcessor,
+                     payments: Iterable[BankPayment]) -> Iterator[Union[BankPayment, PaymentSnapshot]]:
+    """
+    Return copies of payments which may be passed to `processor.process_payments`.
+
+    Payments are either copied to snapshots or deep copied, see `AbstractPaymentProcessor.use_payment_snapshots`.
+    """
+    if not processor.use_payment_snapshots:
+        for payment in payments:
+            yield deepcopy(payment)
+        return
+
+    accounts = {}  # type: dict
+    for payment in payments:
+        if payment.account_id not in accounts:
+            accounts[payment.account_id] = payment.account.get_snapshot()
+        yield payment.get_snapshot(accounts[payment.account_id])
@@ -39,6 +39,7 @@ class IgnorePaymentProcessor(AbstractPaymentProcessor):
     """
 
     default_objective = _('Ignore payment')
+    use_payment_snapshots = True
 
     def process_payments(self, payments: Iterable[BankPayment]) -> Iterable[ProcessPaymentResult]:
         """Reject all payments."""
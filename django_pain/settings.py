@@ -26,6 +26,7 @@ from django.utils import module_loading
 from teller.downloaders import BankStatementDownloader
 from teller.parsers import BankStatementParser
 
+from .locks import AbstractLock
 from .utils import full_class_name
 
 
@@ -164,6 +165,17 @@ class PainSettings(appsettings.AppSettings):
     # Location of process_payments command lock file.
     process_payments_lock_file = appsettings.StringSetting(default='/tmp/pain_process_payments.lock')
 
+    # Dotted path to lock class used by process_payments command.
+    process_payments_lock_backend = appsettings.StringSetting(default='django_pain.locks.FileLock',
+                                                              validators=[ClassPathValidator(AbstractLock)])
+
+    # Delay in seconds before the first retry of a deferred payment in process_payments command.
+    # The delay doubles with each unsuccessful attempt. Zero means deferred payments are retried in every run.
+    process_payments_retry_delay = appsettings.PositiveIntegerSetting(default=0)
+
+    # Maximal delay in seconds between retries of a deferred payment in process_payments command.
+    process_payments_max_retry_delay = appsettings.PositiveIntegerSetting(default=7 * 24 * 60 * 60)
+
     # Whether variable symbol should be trimmed of leading zeros.
     trim_varsym = appsettings.BooleanSetting(default=False)
 
@@ -184,6 +196,17 @@ class PainSettings(appsettings.AppSettings):
         )
     )
 
+    # Payment lists in admin with at least this number of rows estimated by PostgreSQL use the estimate instead of
+    # exact count. Zero means payments are always counted exactly.
+    admin_exact_count_limit = appsettings.PositiveIntegerSetting(default=10000)
+
+    # Number of seconds for which the state of a card payment from the gateway is reused by REST API.
+    # Zero means the gateway is asked on every request.
+    card_payment_state_cache_timeout = appsettings.PositiveIntegerSetting(default=0)
+
+    # Alias of the cache used for card payment states.
+    card_payment_state_cache = appsettings.StringSetting(default='default')
+
     # CSOB card settings
     csob_card = appsettings.NestedDictSetting(dict(
         api_url=appsettings.StringSetting(default='https://api.platebnibrana.csob.cz/api/v1.7/'),
@@ -191,6 +214,15 @@ class PainSettings(appsettings.AppSettings):
         merchant_id=appsettings.StringSetting(required=True),
         merchant_private_key=appsettings.FileSetting(required=True),
         account_name=appsettings.StringSetting(required=True),
+        # HTTP session settings
+        pool_size=appsettings.PositiveIntegerSetting(default=10),
+        keep_alive=appsettings.BooleanSetting(default=True),
+        connect_timeout=appsettings.PositiveFloatSetting(default=3.05),
+        read_timeout=appsettings.PositiveFloatSetting(default=12),
+        # Retries of payment status requests
+        status_retries=appsettings.PositiveIntegerSetting(default=2),
+        retry_backoff=appsettings.PositiveFloatSetting(default=0.5),
+        retry_jitter=appsettings.PositiveFloatSetting(default=0.5),
     ), default=None)
 
     class Meta:
@@ -21,17 +21,21 @@ from datetime import date
 from decimal import ROUND_HALF_UP
 from queue import Queue
 from threading import Event, Thread
+from unittest import skipUnless
+from unittest.mock import patch
 
 from django.contrib import admin
 from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
-from django.db import close_old_connections, transaction
+from django.db import close_old_connections, connection, transaction
 from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from freezegun import freeze_time
 from moneyed.localization import _FORMATTER
 
 from django_pain.admin import BankPaymentAdmin
+from django_pain.admin.paginators import EstimatedCountPaginator
 from django_pain.constants import InvoiceType, PaymentProcessingError, PaymentState
 from django_pain.models import BankAccount, BankPayment
 from django_pain.tests.mixins import CacheResetMixin
@@ -82,6 +86,7 @@ class TestBankAccountAdmin(TestCase):
 @skipUnlessDBFeature('has_select_for_update')
 @override_settings(ROOT_URLCONF='django_pain.tests.urls')
 class TestDatabaseLocking(TransactionTestCase):
+    """Test admin does not lock displayed objects."""
 
     def setUp(self):
         self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
@@ -142,8 +147,9 @@ class TestDatabaseLocking(TransactionTestCase):
                 external_started.set()
                 with transaction.atomic():
                     admin_started.wait()
+                    # Browsing admin must not lock anything.
                     instances = list(model_class.objects.select_for_update(skip_locked=True).all())
-                    self.assertEquals([], instances)
+                    self.assertEqual([instance], instances)
                 external_finished.set()
 
                 with transaction.atomic():
@@ -204,6 +210,47 @@ class TestBankPaymentAdmin(CacheResetMixin, TestCase):
         self.assertContains(response, 'VAR2')
         self.assertContains(response, 'INV111222')
 
+    def test_get_list_queries(self):
+        """Test number of queries of model list does not depend on number of payments."""
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('admin:django_pain_bankpayment_changelist'))
+
+        for index in range(5):
+            payment = get_payment(identifier='Other Payment {}'.format(index), account=self.account,
+                                  state=PaymentState.PROCESSED, processor=self.processed_payment.processor)
+            payment.save()
+            invoice = get_invoice(number='INV{}'.format(index))
+            invoice.save()
+            invoice.payments.add(payment)
+            get_client(handle='HANDLE{}'.format(index), payment=payment).save()
+
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(reverse('admin:django_pain_bankpayment_changelist'))
+        self.assertContains(response, 'INV4')
+        self.assertContains(response, 'HANDLE4')
+        self.assertEqual(len(more_queries), len(queries))
+
+    def test_get_paginator(self):
+        """Test estimated count is used only for the default list of payments."""
+        modeladmin = BankPaymentAdmin(BankPayment, admin.site)
+        queryset = BankPayment.objects.order_by('pk')
+        for params in ({}, {'o': '1', 'p': '2'}, {'q': ''}, {'state__exact': 'all'}):
+            paginator = modeladmin.get_paginator(self.request_factory.get('/', params), queryset, 100)
+            self.assertIsInstance(paginator, EstimatedCountPaginator)
+        for params in ({'q': 'VAR1'}, {'state__exact': 'processed'}, {'account__account_name': 'My Account'}):
+            paginator = modeladmin.get_paginator(self.request_factory.get('/', params), queryset, 100)
+            self.assertNotIsInstance(paginator, EstimatedCountPaginator)
+
+    def test_get_list_count(self):
+        """Test searched list of payments is counted exactly."""
+        self.client.force_login(self.admin)
+        with patch('django_pain.admin.paginators.estimate_count', return_value=50000):
+            response = self.client.get(reverse('admin:django_pain_bankpayment_changelist'))
+            self.assertEqual(response.context['cl'].result_count, 50000)
+            response = self.client.get(reverse('admin:django_pain_bankpayment_changelist'), {'q': 'VAR1'})
+            self.assertEqual(response.context['cl'].result_count, 1)
+
     def test_get_detail(self):
         """Test GET request on model detail."""
         self.client.force_login(self.admin)
@@ -379,6 +426,17 @@ class TestBankPaymentAdminNormalUser(CacheResetMixin, TestCase):
         self.assertEquals('10,000.45&nbsp;Kč', formatted)
 
 
+@skipUnless(connection.vendor == 'postgresql', 'Trigram indexes require PostgreSQL.')
+class TestBankPaymentSearchIndexes(TestCase):
+    """Test indexes used by search of BankPaymentAdmin."""
+
+    def test_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, BankPayment._meta.db_table)
+        for field in BankPaymentAdmin.search_fields:
+            self.assertIn('django_pain_bankpayment_{}_trgm'.format(field), constraints)
+
+
 @override_settings(PAIN_PROCESSORS={
     'linked_dummy': 'django_pain.tests.admin.test_admin.LinkedDummyPaymentProcessor',
 })
@@ -99,6 +99,17 @@ class TestBankPaymentForm(CacheResetMixin, TestCase):
         self.assertFalse(form.is_valid())
         self.assertEqual(form.errors, {'__all__': ['Unable to assign payment']})
 
+    def test_clean_changed_meanwhile(self):
+        """Test clean method with payment changed in the meantime."""
+        BankPayment.objects.filter(pk=self.payment.pk).update(state=PaymentState.PROCESSED)
+        form = self._get_form(data={
+            'processor': 'success',
+            'client_id': '',
+            'tax_date': date(2019, 1, 1),
+        }, instance=self.payment)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'__all__': ['Payment has been changed in the meantime']})
+
     def test_clean_missing_tax_date(self):
         """Test clean method with missing tax date."""
         form = self._get_form(data={
@@ -0,0 +1,83 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test admin paginators."""
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from django_pain.admin.paginators import EstimatedCountPaginator, estimate_count
+from django_pain.constants import PaymentState
+from django_pain.models import BankPayment
+from django_pain.tests.utils import get_account, get_payment
+
+
+class TestEstimateCount(TestCase):
+    """Test estimate_count function."""
+
+    def setUp(self):
+        account = get_account()
+        account.save()
+        get_payment(identifier='PAYMENT_1', account=account).save()
+
+    @skipIf(connection.vendor == 'postgresql', 'Estimate is available on PostgreSQL.')
+    def test_not_available(self):
+        self.assertIsNone(estimate_count(BankPayment.objects.all()))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Estimate requires PostgreSQL.')
+    def test_estimate(self):
+        self.assertIsInstance(estimate_count(BankPayment.objects.filter(state=PaymentState.PROCESSED)), int)
+
+
+class TestEstimatedCountPaginator(TestCase):
+    """Test EstimatedCountPaginator."""
+
+    def setUp(self):
+        account = get_account()
+        account.save()
+        get_payment(identifier='PAYMENT_1', account=account).save()
+        get_payment(identifier='PAYMENT_2', account=account).save()
+
+    def test_count_estimated(self):
+        with patch('django_pain.admin.paginators.estimate_count', return_value=50000):
+            paginator = EstimatedCountPaginator(BankPayment.objects.order_by('pk'), 100)
+            self.assertEqual(paginator.count, 50000)
+            self.assertEqual(paginator.num_pages, 500)
+
+    def test_count_exact(self):
+        with patch('django_pain.admin.paginators.estimate_count', return_value=5):
+            paginator = EstimatedCountPaginator(BankPayment.objects.order_by('pk'), 100)
+            self.assertEqual(paginator.count, 2)
+
+    def test_count_not_available(self):
+        with patch('django_pain.admin.paginators.estimate_count', return_value=None):
+            paginator = EstimatedCountPaginator(BankPayment.objects.order_by('pk'), 100)
+            self.assertEqual(paginator.count, 2)
+
+    @override_settings(PAIN_ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_count_always_exact(self):
+        with patch('django_pain.admin.paginators.estimate_count', return_value=50000) as estimate_mock:
+            paginator = EstimatedCountPaginator(BankPayment.objects.order_by('pk'), 100)
+            self.assertEqual(paginator.count, 2)
+        estimate_mock.assert_not_called()
+
+    def test_count_list(self):
+        paginator = EstimatedCountPaginator([1, 2, 3], 100)
+        self.assertEqual(paginator.count, 3)
@@ -17,6 +17,9 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Test import_payments command."""
+import re
+import threading
+from collections import OrderedDict
 from datetime import date
 from decimal import Decimal
 from io import StringIO
@@ -33,7 +36,7 @@ from teller.parsers import BankStatementParser
 from teller.statement import BankStatement, Payment
 from testfixtures import LogCapture
 
-from django_pain.models import BankAccount, BankPayment
+from django_pain.models import BankAccount, BankPayment, DownloadWatermark
 
 
 class DummyStatementDownloader(BankStatementDownloader):
@@ -51,11 +54,30 @@ class DummyStatementDownloader(BankStatementDownloader):
 
         super().__init__(base_url, timeout)
         self.password = password
+        self.timeout = timeout
 
     def get_statement(self, start_date: date, end_date: date) -> str:
         return self.statement
 
 
+class DummyFailingStatementDownloader(DummyStatementDownloader):
+    """Downloader which fails to download the statement."""
+
+    def get_statement(self, start_date: date, end_date: date) -> str:
+        raise TellerDownloadError('Something went wrong.')
+
+
+class DummySlowStatementDownloader(DummyStatementDownloader):
+    """Downloader which waits until it is released or until its timeout elapses."""
+
+    released = threading.Event()
+
+    def get_statement(self, start_date: date, end_date: date) -> str:
+        if not self.released.wait(self.timeout):
+            raise TellerDownloadError('Read timed out.')
+        return self.statement
+
+
 class DummyStatementParser(BankStatementParser):
     """Simple downloader that just returns two fixed payments."""
 
@@ -280,3 +302,192 @@ class DownloadPaymentsTest(TestCase):
             ('django_pain.management.commands.download_payments', 'INFO', 'Skipped 1 payments.'),
             ('django_pain.management.commands.download_payments', 'INFO', 'Command download_payments finished.')
         )
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_existing_payments_queries(self):
+        call_command('download_payments', '--no-color')
+        # One query for the bank account, one for the existing payments and one for the download watermark.
+        with self.assertNumQueries(3):
+            call_command('download_payments', '--no-color')
+        self.assertEqual(BankPayment.objects.count(), 2)
+
+    @patch('django_pain.tests.commands.test_download_payments.DummyStatementParser.parse_string')
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_duplicate_payment_in_statement(self, mock_method):
+        statement = BankStatement('1234567890/2010')
+        for _ in range(2):
+            statement.add_payment(Payment(identifier='PAYMENT_1', counter_account='098765/4321',
+                                          amount=Money('42.00', 'CZK'), transaction_date=date(2020, 9, 15)))
+        mock_method.return_value = statement
+        call_command('download_payments', '--no-color')
+
+        self.assertEqual(BankPayment.objects.count(), 1)
+        self.assertIn(('django_pain.management.commands.download_payments', 'INFO', 'Skipped 1 payments.'),
+                      self.log_handler.actual())
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_bulk_insert_integrity_error(self):
+        out = StringIO()
+        err = StringIO()
+        call_command('download_payments', '--no-color')
+        with patch('django_pain.management.commands.download_payments.Command._get_existing_keys',
+                   return_value=set()):
+            call_command('download_payments', '--no-color', '--verbosity=2', stdout=out, stderr=err)
+
+        self.assertEqual(out.getvalue(), '')
+        self.assertRegex(err.getvalue(), r'^Payment ID PAYMENT_1 has not been saved due to the following error: ')
+        self.assertEqual(BankPayment.objects.count(), 2)
+        self.assertEqual(self.log_handler.actual()[-2:], [
+            ('django_pain.management.commands.download_payments', 'INFO', 'Skipped 2 payments.'),
+            ('django_pain.management.commands.download_payments', 'INFO', 'Command download_payments finished.'),
+        ])
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_watermark_updated(self):
+        DownloadWatermark.objects.create(downloader='test', transaction_date=date(2020, 9, 16))
+        call_command('download_payments', '--no-color')
+        self.assertQuerysetEqual(DownloadWatermark.objects.values_list('downloader', 'transaction_date'),
+                                 [('test', date(2020, 9, 17))], transform=tuple, ordered=False)
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_watermark_created(self):
+        call_command('download_payments', '--no-color')
+        self.assertQuerysetEqual(DownloadWatermark.objects.values_list('downloader', 'transaction_date'),
+                                 [('test', date(2020, 9, 17))], transform=tuple, ordered=False)
+
+    @override_settings(PAIN_IMPORT_CALLBACKS=['django_pain.import_callbacks.skip_credit_card_transaction_summary'],
+                       PAIN_DOWNLOADERS={'test': {**test_settings, 'PARSER':
+                           'django_pain.tests.commands.test_download_payments.DummyCreditCardSummaryParser'}}) # noqa
+    def test_watermark_rejected_payments(self):
+        call_command('download_payments', '--no-color', '--verbosity=0')
+        self.assertFalse(DownloadWatermark.objects.exists())
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_watermark_unsaved_payments(self):
+        call_command('download_payments', '--no-color')
+        DownloadWatermark.objects.all().delete()
+        with patch('django_pain.management.commands.download_payments.Command._get_existing_keys',
+                   return_value=set()):
+            call_command('download_payments', '--no-color', '--verbosity=0')
+        self.assertFalse(DownloadWatermark.objects.exists())
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_watermark_existing_payments(self):
+        call_command('download_payments', '--no-color')
+        DownloadWatermark.objects.all().delete()
+        call_command('download_payments', '--no-color')
+        self.assertQuerysetEqual(DownloadWatermark.objects.values_list('downloader', 'transaction_date'),
+                                 [('test', date(2020, 9, 17))], transform=tuple, ordered=False)
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_watermark_not_moved_back(self):
+        DownloadWatermark.objects.create(downloader='test', transaction_date=date(2020, 10, 1))
+        call_command('download_payments', '--no-color')
+        self.assertQuerysetEqual(DownloadWatermark.objects.values_list('downloader', 'transaction_date'),
+                                 [('test', date(2020, 10, 1))], transform=tuple, ordered=False)
+
+    @freeze_time("2020-01-09T23:30")
+    @patch('django_pain.tests.commands.test_download_payments.DummyStatementDownloader.get_statement')
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings}, USE_TZ=False)
+    def test_incremental(self, mock_method):
+        DownloadWatermark.objects.create(downloader='test', transaction_date=date(2020, 1, 5))
+
+        call_command('download_payments', '--no-color', '--incremental')
+        mock_method.assert_called_with(date(2020, 1, 4), date(2020, 1, 9))
+
+        call_command('download_payments', '--no-color', '--incremental', '--overlap', '3')
+        mock_method.assert_called_with(date(2020, 1, 2), date(2020, 1, 9))
+
+        call_command('download_payments', '--no-color', '--incremental', '--end', '2020-01-03')
+        mock_method.assert_called_with(date(2020, 1, 3), date(2020, 1, 3))
+
+    @freeze_time("2020-01-09T23:30")
+    @patch('django_pain.tests.commands.test_download_payments.DummyStatementDownloader.get_statement')
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings}, USE_TZ=False)
+    def test_incremental_without_watermark(self, mock_method):
+        call_command('download_payments', '--no-color', '--incremental')
+        mock_method.assert_called_with(date(2020, 1, 2), date(2020, 1, 9))
+
+        call_command('download_payments', '--no-color', '--incremental', '--start', '2020-01-01')
+        mock_method.assert_called_with(date(2020, 1, 1), date(2020, 1, 9))
+
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_incremental_invalid_overlap(self):
+        with self.assertRaisesRegex(CommandError, 'Overlap has to be a non-negative number of days.'):
+            call_command('download_payments', '--no-color', '--incremental', '--overlap', '-1')
+
+
+class DownloadPaymentsConcurrentlyTest(TestCase):
+
+    test_settings = DownloadPaymentsTest.test_settings
+    failing_settings = {
+        **test_settings,
+        'DOWNLOADER': 'django_pain.tests.commands.test_download_payments.DummyFailingStatementDownloader',
+    }
+    slow_settings = {
+        **test_settings,
+        'DOWNLOADER': 'django_pain.tests.commands.test_download_payments.DummySlowStatementDownloader',
+    }
+
+    def setUp(self):
+        self.account = BankAccount.objects.create(account_number='1234567890/2010', currency='CZK')
+        self.log_handler = LogCapture('django_pain.management.commands.download_payments', propagate=False)
+
+    def tearDown(self):
+        self.log_handler.uninstall()
+        DummySlowStatementDownloader.released.set()
+
+    def _get_summary(self):
+        """Return downloader summary log records without timings."""
+        return [(level, re.sub(r'in [0-9.]+ seconds\.$', 'in X seconds.', message))
+                for name, level, message in self.log_handler.actual() if message.startswith('Downloader ')]
+
+    @override_settings(PAIN_DOWNLOADERS=OrderedDict([('test', test_settings), ('failing', failing_settings)]))
+    def test_download_concurrently(self):
+        call_command('download_payments', '--no-color', '--jobs=2')
+
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'account'), [
+            ('PAYMENT_1', self.account.pk),
+            ('PAYMENT_2', self.account.pk),
+        ], transform=tuple, ordered=False)
+        self.assertIn(('django_pain.management.commands.download_payments', 'ERROR',
+                       'Downloading payments for failing failed.'), self.log_handler.actual())
+        self.assertEqual(self._get_summary(), [
+            ('INFO', 'Downloader test succeeded in X seconds.'),
+            ('INFO', 'Downloader failing failed in X seconds.'),
+        ])
+
+    @override_settings(PAIN_DOWNLOADERS=OrderedDict([('slow', slow_settings), ('test', test_settings)]))
+    def test_download_timeout(self):
+        DummySlowStatementDownloader.released.clear()
+        call_command('download_payments', '--no-color', '--jobs=2', '--timeout=0.1')
+
+        self.assertEqual(BankPayment.objects.count(), 2)
+        self.assertIn(('django_pain.management.commands.download_payments', 'ERROR',
+                       'Downloading payments for slow failed.'), self.log_handler.actual())
+        self.assertEqual(self._get_summary(), [
+            ('INFO', 'Downloader slow failed in X seconds.'),
+            ('INFO', 'Downloader test succeeded in X seconds.'),
+        ])
+
+    @override_settings(PAIN_DOWNLOADERS={'slow': slow_settings})
+    def test_download_timeout_serial(self):
+        DummySlowStatementDownloader.released.clear()
+        call_command('download_payments', '--no-color', '--timeout=0.1')
+
+        self.assertEqual(BankPayment.objects.count(), 0)
+        self.assertIn(('django_pain.management.commands.download_payments', 'ERROR',
+                       'Downloading payments for slow failed.'), self.log_handler.actual())
+
+    def test_invalid_timeout(self):
+        with self.assertRaises(CommandError):
+            call_command('download_payments', '--no-color', '--jobs=2', '--timeout=0')
+        with self.assertRaises(CommandError):
+            call_command('download_payments', '--no-color', '--jobs=2', '--timeout=-1')
+
+    @patch('django_pain.tests.commands.test_download_payments.DummyStatementParser.parse_string')
+    @override_settings(PAIN_DOWNLOADERS={'test': test_settings})
+    def test_invalid_account(self, mock_method):
+        mock_method.return_value = BankStatement('11111/11')
+        with self.assertRaisesRegex(CommandError, 'Bank account 11111/11 does not exist'):
+            call_command('download_payments', '--no-color', '--jobs=2')
@@ -0,0 +1,60 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test explain_queries command."""
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from django_pain.management.commands.explain_queries import get_plan_indexes, get_queries
+
+
+class TestGetPlanIndexes(SimpleTestCase):
+    """Test get_plan_indexes function."""
+
+    def test_postgresql(self):
+        plan = ('Limit  (cost=0.42..8.44 rows=1 width=8)\n'
+                '  ->  Index Scan Backward using bankpayment_admin_order_idx on django_pain_bankpayment\n'
+                '        Filter: (state = ANY (\'{processed}\'::text[]))\n'
+                '  ->  Bitmap Index Scan on bankpayment_unprocessed_idx  (cost=0.00..4.18 rows=10 width=0)\n'
+                '  ->  Index Only Scan using bankpayment_admin_order_idx on django_pain_bankpayment')
+        self.assertEqual(get_plan_indexes(plan), ['bankpayment_admin_order_idx', 'bankpayment_unprocessed_idx'])
+
+    def test_sqlite(self):
+        plan = ('3 0 0 SEARCH TABLE django_pain_bankpayment USING INDEX bankpayment_state_time_idx (state=?)\n'
+                '5 0 0 SEARCH TABLE django_pain_bankaccount USING COVERING INDEX account_idx (id=?)')
+        self.assertEqual(get_plan_indexes(plan), ['bankpayment_state_time_idx', 'account_idx'])
+
+    def test_no_index(self):
+        self.assertEqual(get_plan_indexes('2 0 0 SCAN TABLE django_pain_bankpayment'), [])
+
+
+class TestExplainQueries(TestCase):
+    """Test explain_queries command."""
+
+    def test_explain_queries(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(':')[0] for line in lines], list(get_queries()))
+
+    def test_explain_queries_verbose(self):
+        out = StringIO()
+        call_command('explain_queries', verbosity=2, stdout=out)
+        self.assertGreater(len(out.getvalue().splitlines()), len(get_queries()))
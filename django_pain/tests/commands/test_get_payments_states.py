@@ -28,10 +28,17 @@ from django.db import close_old_connections, transaction
 from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
 from testfixtures import LogCapture
 
+from django_pain.card_payment_handlers import PaymentStateResult
 from django_pain.constants import PaymentState
+from django_pain.management.commands.get_card_payments_states import Command
 from django_pain.models import BankAccount, BankPayment
 from django_pain.settings import get_card_payment_handler_class, get_card_payment_handler_instance
-from django_pain.tests.utils import get_payment
+from django_pain.tests.utils import DummyCardPaymentHandler, get_payment
+
+
+def _update_payments_state(payment):
+    """Update state of the payment without saving it."""
+    payment.state = PaymentState.READY_TO_PROCESS
 
 
 @override_settings(PAIN_CARD_PAYMENT_HANDLERS={
@@ -150,6 +157,65 @@ class TestGetPaymentsStates(TestCase):
         with self.assertRaises(CommandError):
             call_command('get_card_payments_states', '--from', '2009-01-01 00:00', '--to', 'not a date')
 
+    def test_get_chunk_states(self):
+        payment = get_payment(identifier='PAYMENT_1', account=self.account, state=PaymentState.INITIALIZED,
+                              card_handler='dummy')
+
+        with patch.object(DummyCardPaymentHandler, 'update_payments_state',
+                          side_effect=_update_payments_state) as update_mock:
+            # Do not close connection of the test case.
+            with patch('django_pain.management.commands.get_card_payments_states.connections') as connections_mock:
+                results = Command._get_chunk_states('dummy', [payment])
+
+        self.assertEqual(results, [PaymentStateResult(payment, None)])
+        self.assertEqual(payment.state, PaymentState.READY_TO_PROCESS)
+        update_mock.assert_called_once_with(payment)
+        connections_mock.close_all.assert_called_once_with()
+
+    def test_concurrent_changed_meanwhile(self):
+        payment = get_payment(identifier='PAYMENT_1', account=self.account, state=PaymentState.INITIALIZED,
+                              card_handler='dummy')
+        payment.save()
+        payment2 = get_payment(identifier='PAYMENT_2', account=self.account, state=PaymentState.INITIALIZED,
+                               card_handler='dummy')
+        payment2.save()
+        payment3 = get_payment(identifier='PAYMENT_3', account=self.account, state=PaymentState.INITIALIZED,
+                               card_handler='dummy_exc')
+        payment3.save()
+        BankPayment.objects.filter(pk=payment2.pk).update(state=PaymentState.CANCELED)
+
+        with override_settings(PAIN_CARD_PAYMENT_HANDLERS={
+                'dummy': 'django_pain.tests.utils.DummyCardPaymentHandler',
+                'dummy_exc': 'django_pain.tests.utils.DummyCardPaymentHandlerExc'}):
+            with patch.object(DummyCardPaymentHandler, 'update_payments_state', side_effect=_update_payments_state):
+                with patch('django_pain.management.commands.get_card_payments_states.connections'):
+                    Command()._get_payments_states_concurrently([payment, payment2, payment3], 2)
+
+        self.log_handler.check(
+            ('django_pain.management.commands.get_card_payments_states', 'INFO',
+             'Getting state of 3 payment(s) using 2 threads.'),
+            ('django_pain.management.commands.get_card_payments_states', 'ERROR',
+             'Error while updating state of payment identifier=PAYMENT_3'),
+        )
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'state').order_by('identifier'),
+                                 [('PAYMENT_1', PaymentState.READY_TO_PROCESS.value),
+                                  ('PAYMENT_2', PaymentState.CANCELED.value),
+                                  ('PAYMENT_3', PaymentState.INITIALIZED.value)],
+                                 transform=tuple)
+
+    def test_concurrent_no_payments(self):
+        call_command('get_card_payments_states', '--jobs', '2')
+
+        self.log_handler.check(
+            ('django_pain.management.commands.get_card_payments_states', 'INFO',
+             'Command get_card_payments_states started.'),
+            ('django_pain.management.commands.get_card_payments_states', 'INFO', 'No payments to update state.')
+        )
+
+    def test_invalid_jobs(self):
+        with self.assertRaises(CommandError):
+            call_command('get_card_payments_states', '--jobs', '0')
+
 
 @skipUnlessDBFeature('has_select_for_update')
 @override_settings(PAIN_CARD_PAYMENT_HANDLERS={
@@ -232,7 +298,13 @@ class TestGetPaymentsStatesLocking(TransactionTestCase):
             processing_started.set()
             query_finished.wait()
             payment.state = PaymentState.READY_TO_PROCESS
-            payment.save()
+
+        def mock_get_payments_states(payments):
+            results = []
+            for payment in payments:
+                mock_update_state(payment)
+                results.append(PaymentStateResult(payment, None))
+            return results
 
         def target_processing():
             try:
@@ -241,7 +313,7 @@ class TestGetPaymentsStatesLocking(TransactionTestCase):
                 get_card_payment_handler_class.cache_clear()
                 with patch('django_pain.tests.utils.DummyCardPaymentHandler') as MockClass:
                     instance = MockClass.return_value
-                    instance.update_payments_state = mock_update_state
+                    instance.get_payments_states = mock_get_payments_states
                     call_command('get_card_payments_states', '--from', datetime.datetime(2018, 5, 1))
             except Exception as e:  # pragma: no cover
                 self.errors.put(e)
@@ -279,3 +351,22 @@ class TestGetPaymentsStatesLocking(TransactionTestCase):
                                  [('PAYMENT_1', PaymentState.READY_TO_PROCESS.value),
                                   ('PAYMENT_2', PaymentState.PROCESSED.value)],
                                  transform=tuple)
+
+    def test_concurrent_run(self):
+        for identifier in ('PAYMENT_1', 'PAYMENT_2', 'PAYMENT_3'):
+            get_payment(identifier=identifier, account=self.account, state=PaymentState.INITIALIZED,
+                        card_handler='dummy').save()
+
+        call_command('get_card_payments_states', '--jobs', '2')
+
+        self.log_handler.check(
+            ('django_pain.management.commands.get_card_payments_states', 'INFO',
+             'Command get_card_payments_states started.'),
+            ('django_pain.management.commands.get_card_payments_states', 'INFO',
+             'Getting state of 3 payment(s) using 2 threads.'),
+        )
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'state').order_by('identifier'),
+                                 [('PAYMENT_1', PaymentState.READY_TO_PROCESS.value),
+                                  ('PAYMENT_2', PaymentState.READY_TO_PROCESS.value),
+                                  ('PAYMENT_3', PaymentState.READY_TO_PROCESS.value)],
+                                 transform=tuple)
@@ -19,17 +19,19 @@
 """Test import_payments command."""
 from datetime import date
 from decimal import Decimal
-from io import StringIO
-from typing import List
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import Iterator, List
+from unittest.mock import patch
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
 from djmoney.money import Money
 from testfixtures import LogCapture, TempDirectory
 
 from django_pain.models import BankAccount, BankPayment
 from django_pain.parsers import AbstractBankStatementParser
+from django_pain.tests.parsers import test_transproc
 from django_pain.tests.utils import get_payment
 
 
@@ -55,6 +57,18 @@ class DummyCreditCardSummaryParser(AbstractBankStatementParser):
         ]
 
 
+class DummyStreamParser(AbstractBankStatementParser):
+    """Simple parser that yields payments and records number of payments already saved in the database."""
+
+    saved_counts = []  # type: List[int]
+
+    def parse(self, bank_statement) -> Iterator[BankPayment]:
+        account = BankAccount.objects.get(account_number='123456/7890')
+        for identifier in ('PAYMENT_1', 'PAYMENT_2', 'PAYMENT_3'):
+            self.saved_counts.append(BankPayment.objects.count())
+            yield get_payment(identifier=identifier, account=account)
+
+
 class DummyExceptionParser(AbstractBankStatementParser):
     """Simple parser that just throws account not exist exception."""
 
@@ -178,6 +192,50 @@ class TestImportPayments(TestCase):
         self.assertEqual(out.getvalue(), '')
         self.assertEqual(err.getvalue(), '')
 
+    def test_import_transproc_stream(self):
+        """Test command with streaming Transproc XML parser."""
+        account = BankAccount.objects.create(account_number='123456789/0123', currency='CZK')
+        out = StringIO()
+        with TempDirectory() as d:
+            d.write('input_file.xml', test_transproc.TestTransprocXMLParser.XML_INPUT)
+            call_command('import_payments', '--parser=django_pain.parsers.transproc.TransprocXMLStreamParser',
+                         '--no-color', '--verbosity=3', '--batch-size=10', '/'.join([d.path, 'input_file.xml']),
+                         stdout=out)
+
+        self.assertEqual(out.getvalue().strip().split('\n'), ['Payment ID 111 has been imported.'])
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'account', 'amount'), [
+            ('111', account.pk, Decimal('1000.00')),
+        ], transform=tuple)
+
+    def _get_windows_1250_statement(self) -> bytes:
+        statement = test_transproc.TestTransprocXMLParser.XML_INPUT.decode()
+        statement = statement.replace('UTF-8', 'windows-1250').replace('See you later', 'Příliš žluťoučký kůň')
+        return statement.encode('windows-1250')
+
+    def test_import_binary_file(self):
+        """Test command opens input file in binary mode if required by the parser."""
+        BankAccount.objects.create(account_number='123456789/0123', currency='CZK')
+        with TempDirectory() as d:
+            d.write('input_file.xml', self._get_windows_1250_statement())
+            call_command('import_payments', '--parser=django_pain.parsers.transproc.TransprocXMLStreamParser',
+                         '--no-color', '--verbosity=0', '--batch-size=10', '/'.join([d.path, 'input_file.xml']))
+
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'description'), [
+            ('111', 'Příliš žluťoučký kůň'),
+        ], transform=tuple)
+
+    def test_import_binary_stdin(self):
+        """Test command reads binary standard input if required by the parser."""
+        BankAccount.objects.create(account_number='123456789/0123', currency='CZK')
+        stdin = TextIOWrapper(BytesIO(self._get_windows_1250_statement()), encoding='utf-8')
+        with patch('sys.stdin', stdin):
+            call_command('import_payments', '--parser=django_pain.parsers.transproc.TransprocXMLParser',
+                         '--no-color', '--verbosity=0')
+
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'description'), [
+            ('111', 'Příliš žluťoučký kůň'),
+        ], transform=tuple)
+
     def test_invalid_parser(self):
         """Test command call with invalid parser."""
         with self.assertRaises(CommandError) as cm:
@@ -212,3 +270,179 @@ class TestImportPayments(TestCase):
                 'Payment is credit card transaction summary.'),
             ('django_pain.management.commands.import_payments', 'INFO', 'Command import_payments finished.'),
         )
+
+    def test_import_payments_bulk(self):
+        """Test import_payments command with bulk inserts."""
+        out = StringIO()
+        call_command('import_payments', '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                     '--no-color', '--verbosity=3', '--batch-size=1', stdout=out)
+
+        self.assertEqual(out.getvalue().strip().split('\n'), [
+            'Payment ID PAYMENT_1 has been imported.',
+            'Payment ID PAYMENT_2 has been imported.',
+        ])
+        self.assertQuerysetEqual(BankPayment.objects.values_list(
+            'identifier', 'account', 'counter_account_number', 'transaction_date', 'amount', 'amount_currency',
+            'variable_symbol',
+        ), [
+            ('PAYMENT_1', self.account.pk, '098765/4321', date(2018, 5, 9), Decimal('42.00'), 'CZK', '1234'),
+            ('PAYMENT_2', self.account.pk, '098765/4321', date(2018, 5, 9), Decimal('370.00'), 'CZK', ''),
+        ], transform=tuple, ordered=False)
+
+    def test_payment_already_exist_bulk(self):
+        """Test command with bulk inserts for payments that already exist in database."""
+        get_payment(identifier='PAYMENT_1', account=self.account).save()
+        out = StringIO()
+        err = StringIO()
+        call_command('import_payments', '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                     '--no-color', '--verbosity=2', '--batch-size=100', stdout=out, stderr=err)
+
+        self.assertEqual(out.getvalue().strip().split('\n'), [
+            'Payment ID PAYMENT_2 has been imported.',
+        ])
+        self.assertEqual(err.getvalue().strip().split('\n'), [
+            'Payment ID PAYMENT_1 has not been saved due to the following errors:',
+            'Bank payment with this Payment ID and Destination account already exists.',
+        ])
+        self.assertEqual(BankPayment.objects.count(), 2)
+
+    def test_payment_duplicate_in_batch(self):
+        """Test command with bulk inserts for payments duplicated within one batch."""
+        payments = [get_payment(identifier='PAYMENT_1', account=self.account),
+                    get_payment(identifier='PAYMENT_1', account=self.account)]
+        err = StringIO()
+        with patch.object(DummyPaymentsParser, 'parse', return_value=payments):
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                         '--no-color', '--batch-size=100', stderr=err)
+
+        self.assertEqual(err.getvalue().strip().split('\n'), [
+            'Payment ID PAYMENT_1 has not been saved due to the following errors:',
+            'Bank payment with this Payment ID and Destination account already exists.',
+        ])
+        self.assertEqual(BankPayment.objects.count(), 1)
+
+    def test_bulk_insert_integrity_error(self):
+        """Test command with bulk inserts falls back to single inserts on integrity error."""
+        out = StringIO()
+        err = StringIO()
+        with patch('django_pain.management.commands.import_payments.Command._get_existing_keys', return_value=set()):
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                         '--no-color', '--verbosity=0', stdout=out, stderr=err)
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                         '--no-color', '--verbosity=2', '--batch-size=100', stdout=out, stderr=err)
+
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual(len(err.getvalue().strip().split('\n')), 2)
+        self.assertRegex(err.getvalue(), r'^Payment ID PAYMENT_1 has not been saved due to the following error: ')
+        self.assertEqual(BankPayment.objects.count(), 2)
+
+    @override_settings(PAIN_IMPORT_CALLBACKS=['django_pain.import_callbacks.skip_credit_card_transaction_summary'])
+    def test_import_callback_exception_bulk(self):
+        """Test import callback raising exception with bulk inserts."""
+        err = StringIO()
+        call_command('import_payments',
+                     '--parser=django_pain.tests.commands.test_import_payments.DummyCreditCardSummaryParser',
+                     '--no-color', '--batch-size=10', stderr=err)
+
+        self.assertEqual(err.getvalue().strip().split('\n'), [
+            'Payment ID PAYMENT_3 has not been saved due to the following errors:',
+            'Payment is credit card transaction summary.',
+        ])
+        self.assertEqual(BankPayment.objects.count(), 0)
+
+    def test_invalid_batch_size(self):
+        """Test command call with invalid batch size."""
+        with self.assertRaises(CommandError):
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                         '--batch-size=0')
+
+    def test_import_payments_pipelined(self):
+        """Test bulk inserts save each batch as soon as it is parsed."""
+        get_payment(identifier='PAYMENT_2', account=self.account).save()
+        DummyStreamParser.saved_counts = []
+        call_command('import_payments', '--parser=django_pain.tests.commands.test_import_payments.DummyStreamParser',
+                     '--no-color', '--verbosity=0', '--batch-size=2')
+
+        self.assertEqual(DummyStreamParser.saved_counts, [1, 1, 2])
+        self.assertEqual(BankPayment.objects.count(), 3)
+        self.log_handler.check(
+            ('django_pain.management.commands.import_payments', 'INFO', 'Command import_payments started.'),
+            ('django_pain.management.commands.import_payments', 'DEBUG', 'Importing payments from -.'),
+            ('django_pain.management.commands.import_payments', 'DEBUG', 'Parsing payments from -.'),
+            ('django_pain.management.commands.import_payments', 'DEBUG',
+                'Saving payments from - to database in batches of 2.'),
+            ('django_pain.management.commands.import_payments', 'WARNING',
+                'Payment ID PAYMENT_2 has not been saved due to the following errors:'),
+            ('django_pain.management.commands.import_payments', 'WARNING',
+                'Bank payment with this Payment ID and Destination account already exists.'),
+            ('django_pain.management.commands.import_payments', 'DEBUG',
+                'Import progress: 2 parsed, 1 saved, 1 skipped.'),
+            ('django_pain.management.commands.import_payments', 'DEBUG',
+                'Import progress: 3 parsed, 2 saved, 1 skipped.'),
+            ('django_pain.management.commands.import_payments', 'INFO',
+                'Imported payments from -: 3 parsed, 2 saved, 1 skipped.'),
+            ('django_pain.management.commands.import_payments', 'INFO', 'Command import_payments finished.'),
+        )
+
+    def test_parallel_import_from_stdin(self):
+        """Test parallel import refuses standard input."""
+        with self.assertRaisesRegex(CommandError, '^Standard input can not be imported in parallel.$'):
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                         '--no-color', '--jobs=2')
+
+
+class TestImportPaymentsParallel(TransactionTestCase):
+    """Test import_payments command with parallel import."""
+
+    def setUp(self):
+        self.account = BankAccount.objects.create(account_number='123456/7890', currency='CZK')
+        self.log_handler = LogCapture('django_pain.management.commands.import_payments', propagate=False)
+        self.tempdir = TempDirectory()
+        self.input_files = []
+        for name in ('input_1.xml', 'input_2.xml', 'input_3.xml'):
+            self.input_files.append(self.tempdir.write(name, b'<whatever></whatever>'))
+
+    def tearDown(self):
+        self.log_handler.uninstall()
+        self.tempdir.cleanup()
+
+    def _test_parallel_import(self, *args):
+        call_command('import_payments', '--parser=django_pain.tests.commands.test_import_payments.DummyPaymentsParser',
+                     '--no-color', '--verbosity=0', '--jobs=2', '--writers=2', *(list(args) + self.input_files))
+
+        # The same payments are in all files, they have to be saved only once.
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'account'), [
+            ('PAYMENT_1', self.account.pk),
+            ('PAYMENT_2', self.account.pk),
+        ], transform=tuple, ordered=False)
+        self.assertEqual(self.log_handler.actual()[-2:], [
+            ('django_pain.management.commands.import_payments', 'INFO',
+                'Imported payments from 3 files: 6 parsed, 2 saved, 4 skipped.'),
+            ('django_pain.management.commands.import_payments', 'INFO', 'Command import_payments finished.'),
+        ])
+
+    def test_parallel_import_single_writer(self):
+        self._test_parallel_import('--writers=1')
+
+    # Concurrent writes to the in-memory SQLite database fail on table locks.
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_parallel_import(self):
+        self._test_parallel_import()
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_parallel_import_bulk(self):
+        self._test_parallel_import('--batch-size=10')
+
+    def test_parallel_import_account_not_exist(self):
+        with self.assertRaises(CommandError) as cm:
+            call_command('import_payments',
+                         '--parser=django_pain.tests.commands.test_import_payments.DummyExceptionParser',
+                         '--no-color', '--jobs=2', *self.input_files)
+
+        self.assertEqual(str(cm.exception), 'Bank account ACCOUNT does not exist.')
+        self.assertEqual(BankPayment.objects.count(), 0)
@@ -22,19 +22,21 @@ import fcntl
 import os
 import threading
 from collections import OrderedDict
-from datetime import date
+from datetime import date, datetime
 from io import StringIO
 from queue import Queue
+from unittest import skipIf
 from unittest.mock import patch
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.db import close_old_connections, transaction
+from django.db import close_old_connections, connection, transaction
 from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
 from freezegun import freeze_time
 from testfixtures import LogCapture, TempDirectory
 
 from django_pain.constants import PaymentProcessingError, PaymentState, PaymentType
+from django_pain.management.commands.process_payments import Command, _process_shard
 from django_pain.models import BankAccount, BankPayment
 from django_pain.processors import ProcessPaymentResult
 from django_pain.settings import SETTINGS, get_processor_class, get_processor_instance
@@ -199,6 +201,21 @@ class TestProcessPaymentsLocks(CacheResetMixin, TransactionTestCase):
                 ('PAYMENT_2', self.account_ex.pk, PaymentState.PROCESSED, 'manual')],
             transform=tuple, ordered=False)
 
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'})
+    def test_sharded_processing(self):
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            out = StringIO()
+            err = StringIO()
+            call_command('process_payments', '--jobs', '2', stdout=out, stderr=err)
+
+        self.assertEqual(err.getvalue(), '')
+        self.assertQuerysetEqual(
+            BankPayment.objects.values_list('identifier', 'account', 'state', 'processor'),
+            [('PAYMENT_1', self.account_in.pk, PaymentState.PROCESSED, 'dummy'),
+                ('PAYMENT_2', self.account_ex.pk, PaymentState.PROCESSED, 'dummy')],
+            transform=tuple, ordered=False)
+
 
 @freeze_time('2018-01-01')
 class TestProcessPayments(CacheResetMixin, TestCase):
@@ -380,6 +397,46 @@ class TestProcessPayments(CacheResetMixin, TestCase):
                 ('django_pain.management.commands.process_payments', 'WARNING', 'Command already running. Terminating.')
             )
 
+    def test_lock_sharded(self):
+        """Test sharded processing uses the lock of the command."""
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            lock = open(SETTINGS.process_payments_lock_file, 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            err = StringIO()
+            # Do not close connection of the test case.
+            with patch('django_pain.management.commands.process_payments.close_connections_before_fork'):
+                call_command('process_payments', '--no-color', '--jobs', '2', stderr=err)
+            lock.close()
+
+        self.assertEqual(err.getvalue(), 'Command process_payments is already running. Terminating.\n')
+        self.assertEqual(BankPayment.objects.get().state, PaymentState.READY_TO_PROCESS)
+        self.log_handler.check(
+            ('django_pain.management.commands.process_payments', 'INFO', 'Command process_payments started.'),
+            ('django_pain.management.commands.process_payments', 'INFO', 'Processing payments in 2 shards.'),
+            ('django_pain.management.commands.process_payments', 'WARNING', 'Command already running. Terminating.')
+        )
+
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'})
+    def test_concurrent(self):
+        """Test process payments does not use lock in concurrent mode."""
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            lock = open(SETTINGS.process_payments_lock_file, 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            err = StringIO()
+            call_command('process_payments', '--concurrent', stderr=err)
+            lock.close()
+
+        self.assertEqual(err.getvalue(), '')
+        self.assertEqual(BankPayment.objects.get().state, PaymentState.PROCESSED)
+
+    @override_settings(PAIN_PROCESS_PAYMENTS_LOCK_BACKEND='django_pain.locks.PostgresAdvisoryLock')
+    @skipIf(connection.vendor == 'postgresql', 'Advisory locks are supported by PostgreSQL.')
+    def test_advisory_lock_not_supported(self):
+        """Test process payments with advisory lock on database other than PostgreSQL."""
+        with self.assertRaisesMessage(CommandError, 'requires PostgreSQL database. Terminating.'):
+            call_command('process_payments')
+
     def test_invalid_lock(self):
         """Test process payments with invalid lock file."""
         with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
@@ -577,3 +634,174 @@ class TestProcessPayments(CacheResetMixin, TestCase):
                  'Marking 0 unprocessed payments as DEFERRED.'),
                 ('django_pain.management.commands.process_payments', 'INFO', 'Command process_payments finished.'),
             )
+
+    @override_settings(PAIN_PROCESSORS=OrderedDict([
+        ('dummy', 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'),
+        ('dummy_false', 'django_pain.tests.commands.test_process_payments.DummyFalsePaymentProcessor'),
+    ]))
+    def test_payments_processed_in_chunks(self):
+        get_payment(identifier='PAYMENT_2', account=self.account, state=PaymentState.DEFERRED).save()
+        get_payment(identifier='PAYMENT_3', account=self.account, state=PaymentState.READY_TO_PROCESS,
+                    payment_type=PaymentType.CARD_PAYMENT, counter_account_number='', processor='dummy_false').save()
+        get_payment(identifier='PAYMENT_4', account=self.account, state=PaymentState.PROCESSED).save()
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            call_command('process_payments', '--chunk-size', '2')
+
+            self.assertQuerysetEqual(
+                BankPayment.objects.values_list('identifier', 'state', 'processor'),
+                [('PAYMENT_1', PaymentState.PROCESSED, 'dummy'),
+                 ('PAYMENT_2', PaymentState.PROCESSED, 'dummy'),
+                 ('PAYMENT_3', PaymentState.DEFERRED, 'dummy_false'),
+                 ('PAYMENT_4', PaymentState.PROCESSED, '')],
+                transform=tuple, ordered=False)
+            self.log_handler.check(
+                ('django_pain.management.commands.process_payments', 'INFO', 'Command process_payments started.'),
+                ('django_pain.management.commands.process_payments', 'INFO', 'Lock acquired.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Processing unprocessed payments in chunks of 2 payments.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Processing chunk of 2 unprocessed payments.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Processing payments with processor dummy.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Marking 0 unprocessed payments as DEFERRED.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Processing chunk of 1 unprocessed payments.'),
+                ('django_pain.management.commands.process_payments', 'INFO', 'Processing card payments.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Processing card payments with processor dummy_false.'),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Saving payment %s as DEFERRED with error None.'
+                 % BankPayment.objects.get(identifier='PAYMENT_3').uuid),
+                ('django_pain.management.commands.process_payments', 'INFO',
+                 'Marking 0 unprocessed payments as DEFERRED.'),
+                ('django_pain.management.commands.process_payments', 'INFO', 'Processed 3 unprocessed payments.'),
+                ('django_pain.management.commands.process_payments', 'INFO', 'Command process_payments finished.'),
+            )
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(CommandError):
+            call_command('process_payments', '--chunk-size', '0')
+
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyFalsePaymentProcessor'})
+    def test_deferred_payments_without_retry_delay(self):
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            call_command('process_payments')
+            call_command('process_payments')
+
+        self.assertQuerysetEqual(
+            BankPayment.objects.values_list('identifier', 'state', 'processing_attempts', 'next_processing_time'),
+            [('PAYMENT_1', PaymentState.DEFERRED, 2, None)],
+            transform=tuple, ordered=False)
+
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyFalsePaymentProcessor'},
+        PAIN_PROCESS_PAYMENTS_RETRY_DELAY=60, PAIN_PROCESS_PAYMENTS_MAX_RETRY_DELAY=150)
+    def test_deferred_payments_retry_delay(self):
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            call_command('process_payments')
+            payment = BankPayment.objects.get(identifier='PAYMENT_1')
+            self.assertEqual(payment.processing_attempts, 1)
+            self.assertEqual(payment.next_processing_time, datetime(2018, 1, 1, 0, 1))
+
+            # Retry delay has not elapsed yet.
+            with freeze_time('2018-01-01 00:00:59'):
+                call_command('process_payments')
+            payment = BankPayment.objects.get(identifier='PAYMENT_1')
+            self.assertEqual(payment.processing_attempts, 1)
+
+            with freeze_time('2018-01-01 00:01'):
+                call_command('process_payments')
+            payment = BankPayment.objects.get(identifier='PAYMENT_1')
+            # Retry delay is doubled.
+            self.assertEqual(payment.processing_attempts, 2)
+            self.assertEqual(payment.next_processing_time, datetime(2018, 1, 1, 0, 3))
+
+            # Retry delay is limited by the maximal retry delay.
+            with freeze_time('2018-01-01 00:03'):
+                call_command('process_payments')
+            payment = BankPayment.objects.get(identifier='PAYMENT_1')
+            self.assertEqual(payment.processing_attempts, 3)
+            self.assertEqual(payment.next_processing_time, datetime(2018, 1, 1, 0, 5, 30))
+
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'},
+        PAIN_PROCESS_PAYMENTS_RETRY_DELAY=60)
+    def test_ready_payments_ignore_retry_delay(self):
+        BankPayment.objects.update(processing_attempts=1, next_processing_time=datetime(2018, 1, 2))
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            call_command('process_payments')
+
+        self.assertQuerysetEqual(
+            BankPayment.objects.values_list('identifier', 'state', 'processing_attempts'),
+            [('PAYMENT_1', PaymentState.PROCESSED, 1)],
+            transform=tuple, ordered=False)
+
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'})
+    def test_process_shard(self):
+        account2 = BankAccount.objects.create(account_number='987654/3210', currency='CZK')
+        get_payment(identifier='PAYMENT_2', account=account2, state=PaymentState.READY_TO_PROCESS).save()
+        filters = {'time_from': None, 'time_to': None, 'include_accounts': None, 'exclude_accounts': None}
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            # Do not close connection of the test case.
+            with patch('django_pain.management.commands.process_payments.connections'):
+                self.assertTrue(_process_shard(filters, None, account2.pk % 2, 2))
+
+        self.assertQuerysetEqual(
+            BankPayment.objects.values_list('identifier', 'state', 'processor'),
+            [('PAYMENT_1', PaymentState.READY_TO_PROCESS, ''),
+             ('PAYMENT_2', PaymentState.PROCESSED, 'dummy')],
+            transform=tuple, ordered=False)
+
+    def test_process_shard_locked(self):
+        filters = {'time_from': None, 'time_to': None, 'include_accounts': None, 'exclude_accounts': None}
+        with override_settings(PAIN_PROCESS_PAYMENTS_LOCK_FILE=os.path.join(self.tempdir.path, 'test.lock')):
+            lock = open(SETTINGS.process_payments_lock_file + '.2.1', 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            with patch('django_pain.management.commands.process_payments.connections'):
+                self.assertFalse(_process_shard(filters, None, 1, 2))
+            lock.close()
+
+        self.assertEqual(BankPayment.objects.get().state, PaymentState.READY_TO_PROCESS)
+
+
+class TestSavePayments(TestCase):
+    """Test saving of payments in process_payments command."""
+
+    def setUp(self):
+        self.account = BankAccount.objects.create(account_number='123456/7890', currency='CZK')
+        for identifier in ('PAYMENT_1', 'PAYMENT_2', 'PAYMENT_3'):
+            get_payment(identifier=identifier, account=self.account, state=PaymentState.READY_TO_PROCESS).save()
+
+    def test_save_payments(self):
+        payments = list(BankPayment.objects.order_by('identifier'))
+        for payment in payments:
+            payment.state = PaymentState.PROCESSED
+            payment.processor = 'dummy'
+            # Changes of other fields are not saved.
+            payment.description = 'Changed'
+        payments[2].processor = 'other'
+
+        # One query for each group of payments with the same values.
+        with self.assertNumQueries(2):
+            Command._save_payments(payments, ('state', 'processor'))
+
+        self.assertQuerysetEqual(
+            BankPayment.objects.values_list('identifier', 'state', 'processor', 'description'),
+            [('PAYMENT_1', PaymentState.PROCESSED, 'dummy', ''),
+             ('PAYMENT_2', PaymentState.PROCESSED, 'dummy', ''),
+             ('PAYMENT_3', PaymentState.PROCESSED, 'other', '')],
+            transform=tuple, ordered=False)
+
+    @patch('django_pain.management.commands.process_payments.UPDATE_BATCH_SIZE', 2)
+    def test_save_payments_batches(self):
+        payments = list(BankPayment.objects.all())
+        for payment in payments:
+            payment.state = PaymentState.DEFERRED
+
+        with self.assertNumQueries(2):
+            Command._save_payments(payments, ('state',))
+
+        self.assertEqual(BankPayment.objects.filter(state=PaymentState.DEFERRED).count(), 3)
@@ -18,18 +18,21 @@
 
 """Test TransprocXMLParser."""
 from datetime import datetime
-from io import BytesIO
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
 from django.test import TestCase, override_settings
 from djmoney.money import Money
 
 from django_pain.models import BankAccount
-from django_pain.parsers.transproc import TransprocXMLParser
+from django_pain.parsers.transproc import TransprocXMLParser, TransprocXMLStreamParser
 
 
 class TestTransprocXMLParser(TestCase):
     """Test FioXMLParser."""
 
+    parser_class = TransprocXMLParser
+
     XML_INPUT = b'''<?xml version="1.0" encoding="UTF-8"?>
         <statements>
             <statement>
@@ -97,7 +100,7 @@ class TestTransprocXMLParser(TestCase):
     def test_parse(self):
         account = BankAccount(account_number='123456789/0123', currency='CZK')
         account.save()
-        parser = TransprocXMLParser()
+        parser = self.parser_class()
         payments = list(parser.parse(BytesIO(self.XML_INPUT)))
 
         payment = {
@@ -122,13 +125,60 @@ class TestTransprocXMLParser(TestCase):
     def test_trim_varsym(self):
         account = BankAccount(account_number='123456789/0123', currency='CZK')
         account.save()
-        parser = TransprocXMLParser()
+        parser = self.parser_class()
         payments = list(parser.parse(BytesIO(self.ZERO_IN_VARSYM_XML)))
         self.assertEqual(payments[0].variable_symbol, '700')
 
     def test_parse_account_not_exists(self):
         """Parser should raise an exception if bank account does not exist."""
-        parser = TransprocXMLParser()
+        parser = self.parser_class()
         with self.assertRaisesRegex(BankAccount.DoesNotExist, 'Bank account 123456789/0123 does not exist.'):
             output = parser.parse(BytesIO(self.XML_INPUT))
             next(output)
+
+
+class TestTransprocXMLStreamParser(TestTransprocXMLParser):
+    """Test TransprocXMLStreamParser."""
+
+    parser_class = TransprocXMLStreamParser
+
+    EMPTY_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+        <statements>
+            <statement>
+                <account_number>123456789</account_number>
+                <account_bank_code>0123</account_bank_code>
+                <date>2012-12-31</date>
+                <items>
+                </items>
+            </statement>
+        </statements>'''
+
+    def test_processed_items_discarded(self):
+        account = BankAccount(account_number='123456789/0123', currency='CZK')
+        account.save()
+        parser = self.parser_class()
+        items = []  # type: list
+        with patch.object(TransprocXMLStreamParser, 'parse_item', side_effect=lambda item, account: items.append(item)):
+            list(parser.parse(BytesIO(self.XML_INPUT)))
+
+        self.assertEqual(len(items), 2)
+        for item in items:
+            self.assertEqual(len(item), 0)
+        # Only the last item is left in the tree.
+        self.assertEqual(len(items[1].getparent()), 1)
+
+    def test_parse_text(self):
+        """Parser should accept bank statement read in text mode."""
+        account = BankAccount(account_number='123456789/0123', currency='CZK')
+        account.save()
+        parser = self.parser_class()
+        payments = list(parser.parse(StringIO(self.XML_INPUT.decode())))
+
+        self.assertEqual([payment.identifier for payment in payments], ['111'])
+        self.assertEqual(payments[0].account, account)
+
+    def test_parse_account_not_exists_without_items(self):
+        """Parser should raise an exception if bank account does not exist even for empty statement."""
+        parser = self.parser_class()
+        with self.assertRaisesRegex(BankAccount.DoesNotExist, 'Bank account 123456789/0123 does not exist.'):
+            list(parser.parse(BytesIO(self.EMPTY_XML)))
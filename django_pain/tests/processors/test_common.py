@@ -17,10 +17,12 @@
 # along with FRED.  If not, see <https://www.gnu.org/licenses/>.
 
 """Test common payment processor."""
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
 
 from django_pain.constants import PaymentProcessingError
-from django_pain.processors import ProcessPaymentResult
+from django_pain.models import BankPayment, PaymentSnapshot
+from django_pain.processors import IgnorePaymentProcessor, ProcessPaymentResult, prepare_payments
+from django_pain.tests.utils import DummyPaymentProcessor, get_account, get_payment
 
 
 class TestProcessPaymentResult(SimpleTestCase):
@@ -45,3 +47,32 @@ class TestProcessPaymentResult(SimpleTestCase):
             ProcessPaymentResult(False) == ProcessPaymentResult(False, PaymentProcessingError.DUPLICITY),
             False
         )
+
+
+class TestPreparePayments(TestCase):
+    """Test prepare_payments."""
+
+    def setUp(self):
+        self.account = get_account()
+        self.account.save()
+        self.payments = [get_payment(identifier='PAYMENT1', account=self.account),
+                         get_payment(identifier='PAYMENT2', account=self.account)]
+        for payment in self.payments:
+            payment.save()
+
+    def test_deep_copies(self):
+        payments = list(prepare_payments(DummyPaymentProcessor(), self.payments))
+
+        self.assertEqual([type(payment) for payment in payments], [BankPayment, BankPayment])
+        self.assertEqual(payments, self.payments)
+        self.assertIsNot(payments[0], self.payments[0])
+
+    def test_snapshots(self):
+        payments = BankPayment.objects.order_by('identifier')
+        with self.assertNumQueries(2):
+            snapshots = list(prepare_payments(IgnorePaymentProcessor(), payments))
+
+        self.assertEqual([type(snapshot) for snapshot in snapshots], [PaymentSnapshot, PaymentSnapshot])
+        self.assertEqual([snapshot.identifier for snapshot in snapshots], ['PAYMENT1', 'PAYMENT2'])
+        self.assertEqual(snapshots[0].account, self.account.get_snapshot())
+        self.assertIs(snapshots[0].account, snapshots[1].account)
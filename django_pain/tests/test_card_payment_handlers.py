@@ -18,18 +18,27 @@
 
 """Tests of card payment handlers."""
 import datetime
+import json
+import os
+import tempfile
 from collections import OrderedDict
-from unittest.mock import Mock, patch, sentinel
+from unittest.mock import Mock, call, patch, sentinel
 
 import requests
-from django.test import TestCase
+from Crypto.PublicKey import RSA
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
 from djmoney.money import Money
-from pycsob import conf as CSOB
+from pycsob import conf as CSOB, utils as csob_utils
+from pycsob.utils import sign as pycsob_sign
 
 from django_pain.card_payment_handlers import (CartItem, CSOBCardPaymentHandler, PaymentHandlerConnectionError,
-                                               PaymentHandlerError)
+                                               PaymentHandlerError, PaymentStateResult)
+from django_pain.card_payment_handlers.csob import CSOBHTTPAdapter, JitterRetry
+from django_pain.card_payment_handlers.csob_signing import CachedKeysCsobClient, load_key, sign, verify
 from django_pain.constants import PaymentState, PaymentType
-from django_pain.tests.utils import get_account, get_payment
+from django_pain.models import BankPayment
+from django_pain.tests.utils import DummyCardPaymentHandler, DummyCardPaymentHandlerConnExc, get_account, get_payment
 
 
 class TestCSOBCardPaymentHandlerStatus(TestCase):
@@ -116,6 +125,227 @@ class TestCSOBCardPaymentHandlerStatus(TestCase):
 
             self.assertRaises(PaymentHandlerConnectionError, handler.update_payments_state, payment)
 
+    def test_get_payments_states(self):
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment_ok = get_payment(identifier='1', account=account, counter_account_number='',
+                                 payment_type=PaymentType.CARD_PAYMENT, state=PaymentState.INITIALIZED,
+                                 card_handler='csob')
+        payment_ok.save()
+        payment_error = get_payment(identifier='2', account=account, counter_account_number='',
+                                    payment_type=PaymentType.CARD_PAYMENT, state=PaymentState.INITIALIZED,
+                                    card_handler='csob')
+        payment_error.save()
+
+        result_ok = Mock()
+        result_ok.payload = {'paymentStatus': CSOB.PAYMENT_STATUS_CONFIRMED, 'resultCode': CSOB.RETURN_CODE_OK}
+        result_error = Mock()
+        result_error.payload = {'resultCode': CSOB.RETURN_CODE_MERCHANT_BLOCKED}
+
+        handler = CSOBCardPaymentHandler('csob')
+        with patch.object(handler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.side_effect = [result_ok, result_error]
+            results = handler.get_payments_states([payment_ok, payment_error])
+
+        self.assertEqual([result.payment for result in results], [payment_ok, payment_error])
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, PaymentHandlerError)
+        self.assertEqual(payment_ok.state, PaymentState.READY_TO_PROCESS)
+        self.assertEqual(payment_ok.card_payment_state, CSOB.PAYMENT_STATUSES[CSOB.PAYMENT_STATUS_CONFIRMED])
+        # Payments are not saved.
+        self.assertQuerysetEqual(BankPayment.objects.values_list('identifier', 'state').order_by('identifier'),
+                                 [('1', PaymentState.INITIALIZED.value), ('2', PaymentState.INITIALIZED.value)],
+                                 transform=tuple)
+
+    def test_get_payments_states_connection_error(self):
+        payment = get_payment(identifier='1', counter_account_number='', payment_type=PaymentType.CARD_PAYMENT,
+                              state=PaymentState.INITIALIZED, card_handler='csob')
+
+        handler = CSOBCardPaymentHandler('csob')
+        with patch.object(handler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.side_effect = requests.ConnectionError()
+            results = handler.get_payments_states([payment])
+
+        self.assertIsInstance(results[0].error, PaymentHandlerConnectionError)
+        self.assertEqual(payment.state, PaymentState.INITIALIZED)
+
+
+class TestAbstractCardPaymentHandler(TestCase):
+    """Test AbstractCardPaymentHandler default methods."""
+
+    def test_get_payments_states(self):
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT, state=PaymentState.INITIALIZED)
+        payment.save()
+
+        results = DummyCardPaymentHandler('dummy').get_payments_states([payment])
+
+        self.assertEqual(results, [PaymentStateResult(payment, None)])
+        self.assertEqual(payment.state, PaymentState.READY_TO_PROCESS)
+        # Payment saved by `update_payments_state` is rolled back.
+        self.assertEqual(BankPayment.objects.get(pk=payment.pk).state, PaymentState.INITIALIZED)
+
+    def test_get_payments_states_error(self):
+        payment = get_payment(identifier='1')
+
+        results = DummyCardPaymentHandlerConnExc('dummy').get_payments_states([payment])
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].payment, payment)
+        self.assertIsInstance(results[0].error, PaymentHandlerConnectionError)
+
+
+class TestCSOBHTTPSession(SimpleTestCase):
+    """Test HTTP session of CSOBCardPaymentHandler."""
+
+    def test_session(self):
+        session = CSOBCardPaymentHandler('csob').client.session
+        adapter = session.get_adapter('https://api.platebnibrana.csob.cz/')
+
+        self.assertIsInstance(adapter, CSOBHTTPAdapter)
+        self.assertEqual(adapter.timeout, (3.05, 12))
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertIsInstance(adapter.max_retries, JitterRetry)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertEqual(adapter.max_retries.jitter, 0.5)
+        self.assertEqual(session.headers['Connection'], 'keep-alive')
+        self.assertEqual(session.headers['User-Agent'], CSOB.HEADERS['user-agent'])
+
+    def test_session_settings(self):
+        csob_card = dict(settings.PAIN_CSOB_CARD, POOL_SIZE=20, KEEP_ALIVE=False, CONNECT_TIMEOUT=1, READ_TIMEOUT=5,
+                         STATUS_RETRIES=0)
+        with override_settings(PAIN_CSOB_CARD=csob_card):
+            session = CSOBCardPaymentHandler('csob').client.session
+        adapter = session.get_adapter('https://api.platebnibrana.csob.cz/')
+
+        self.assertEqual(adapter.timeout, (1, 5))
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertEqual(session.headers['Connection'], 'close')
+        self.assertNotIn('Connection', CSOB.HEADERS)
+
+    def test_adapter_default_timeout(self):
+        adapter = CSOBHTTPAdapter()
+        with patch('requests.adapters.HTTPAdapter.send') as send_mock:
+            adapter.send(sentinel.request, timeout=None)
+            adapter.send(sentinel.request, timeout=42)
+        self.assertEqual(send_mock.mock_calls, [
+            call(sentinel.request, stream=False, timeout=(3.05, 12), verify=True, cert=None, proxies=None),
+            call(sentinel.request, stream=False, timeout=42, verify=True, cert=None, proxies=None),
+        ])
+
+    def test_retry_only_get(self):
+        retry = JitterRetry(total=2, status_forcelist=(503,))
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+
+    def test_retry_jitter(self):
+        retry = JitterRetry(total=2, backoff_factor=0, jitter=1)
+        with patch('django_pain.card_payment_handlers.csob.random.uniform', return_value=0.25) as uniform_mock:
+            self.assertEqual(retry.get_backoff_time(), 0.25)
+        uniform_mock.assert_called_once_with(0, 1)
+        self.assertEqual(retry.new(total=1).jitter, 1)
+
+
+class TestCSOBSigning(SimpleTestCase):
+    """Test signing of CSOB Gateway messages using cached keys."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        key = RSA.generate(1024)
+        cls.private_key = os.path.join(cls.directory.name, 'private.key')
+        cls.public_key = os.path.join(cls.directory.name, 'public.key')
+        with open(cls.private_key, 'wb') as handle:
+            handle.write(key.exportKey())
+        with open(cls.public_key, 'wb') as handle:
+            handle.write(key.publickey().exportKey())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        load_key.cache_clear()
+        self.payload = OrderedDict([('merchantId', 'MERCHANT'), ('payId', 'PAY_ID'), ('dttm', '20260101120000')])
+
+    def test_key_cached(self):
+        with patch('django_pain.card_payment_handlers.csob_signing.RSA.importKey',
+                   wraps=RSA.importKey) as import_mock:
+            sign(self.payload, self.private_key)
+            sign(self.payload, self.private_key)
+        import_mock.assert_called_once_with(open(self.private_key).read())
+
+    def test_sign_verify(self):
+        signature = sign(self.payload, self.private_key)
+        self.assertEqual(signature, pycsob_sign(self.payload, self.private_key))
+        self.assertTrue(verify(self.payload, signature, self.public_key))
+        self.assertFalse(verify(OrderedDict(self.payload, payId='OTHER'), signature, self.public_key))
+
+    def test_payment_init(self):
+        session_mock = Mock(spec=requests.Session)
+        client = CachedKeysCsobClient('MERCHANT', 'https://example.org/api/', self.private_key, self.public_key,
+                                      session=session_mock)
+        response_data = OrderedDict([('payId', 'PAY_ID'), ('dttm', '20260101120000'), ('resultCode', 0),
+                                     ('resultMessage', 'OK'), ('paymentStatus', 1)])
+        signature = sign(response_data, self.private_key)
+        response = Mock(json=Mock(side_effect=lambda: dict(response_data, signature=signature)))
+        with patch('django_pain.card_payment_handlers.csob_signing.RSA.importKey',
+                   wraps=RSA.importKey) as import_mock:
+            session_mock.post.return_value = response
+            self.assertEqual(client.payment_init(42, 1000, 'https://example.org/', 'Payment'), response)
+            client.payment_init(43, 1000, 'https://example.org/', 'Payment')
+
+        # Private key was parsed by the signature of the response above.
+        with open(self.public_key) as handle:
+            import_mock.assert_called_once_with(handle.read())
+        payload = json.loads(session_mock.post.call_args[1]['data'], object_pairs_hook=OrderedDict)
+        self.assertEqual(payload['orderNo'], '43')
+        self.assertTrue(verify(OrderedDict((key, value) for key, value in payload.items() if key != 'signature'),
+                               payload['signature'], self.public_key))
+        self.assertEqual(response.payload['paymentStatus'], 1)
+        # Functions of pycsob are left intact.
+        self.assertIs(csob_utils.sign, pycsob_sign)
+
+    def test_payment_status(self):
+        session_mock = Mock(spec=requests.Session)
+        client = CachedKeysCsobClient('MERCHANT', 'https://example.org/api/', self.private_key, self.public_key,
+                                      session=session_mock)
+        response_data = OrderedDict([('payId', 'PAY_ID'), ('dttm', '20260101120000'), ('resultCode', 0),
+                                     ('resultMessage', 'OK'), ('paymentStatus', 4)])
+        signature = sign(response_data, self.private_key)
+        response = Mock(json=Mock(side_effect=lambda: dict(response_data, signature=signature)))
+        session_mock.get.return_value = response
+        self.assertEqual(client.payment_status('PAY_ID'), response)
+
+        url = session_mock.get.call_args[1]['url']
+        self.assertTrue(url.startswith('https://example.org/api/payment/status/MERCHANT/PAY_ID/'))
+        self.assertEqual(response.payload['paymentStatus'], 4)
+        self.assertEqual(response.payload['dttime'], datetime.datetime(2026, 1, 1, 12))
+        self.assertEqual(response.extensions, [])
+
+    def test_payment_status_not_verified(self):
+        session_mock = Mock(spec=requests.Session)
+        client = CachedKeysCsobClient('MERCHANT', 'https://example.org/api/', self.private_key, self.public_key,
+                                      session=session_mock)
+        response_data = OrderedDict([('payId', 'PAY_ID'), ('resultCode', 0), ('paymentStatus', 4)])
+        signature = sign(response_data, self.private_key)
+        response = Mock(json=Mock(side_effect=lambda: dict(response_data, paymentStatus=7, signature=signature)))
+        session_mock.get.return_value = response
+        with self.assertRaises(csob_utils.CsobVerifyError):
+            client.payment_status('PAY_ID')
+
+    def test_gateway_return(self):
+        client = CachedKeysCsobClient('MERCHANT', 'https://example.org/api/', self.private_key, self.public_key)
+        data = OrderedDict([('payId', 'PAY_ID'), ('resultCode', 0), ('paymentStatus', 7)])
+        datadict = {'payId': 'PAY_ID', 'resultCode': '0', 'paymentStatus': '7',
+                    'signature': sign(data, self.private_key)}
+        self.assertEqual(client.gateway_return(datadict), data)
+
 
 class TestCSOBCardPaymentHandlerInit(TestCase):
     """Test CSOBCardPaymentHandler.init_payment method."""
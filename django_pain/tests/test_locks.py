@@ -0,0 +1,82 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Test locks."""
+import os
+from unittest import skipIf, skipUnless
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from testfixtures import TempDirectory
+
+from django_pain.locks import FileLock, LockError, PostgresAdvisoryLock
+
+
+class TestFileLock(SimpleTestCase):
+    """Test FileLock."""
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+        self.lock_file = os.path.join(self.tempdir.path, 'test.lock')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_acquire_release(self):
+        lock = FileLock(self.lock_file)
+        other_lock = FileLock(self.lock_file)
+
+        self.assertTrue(lock.acquire())
+        self.assertFalse(other_lock.acquire())
+        lock.release()
+        self.assertTrue(other_lock.acquire())
+        other_lock.release()
+
+    def test_release_not_acquired(self):
+        FileLock(self.lock_file).release()
+
+    def test_error(self):
+        os.mkdir(self.lock_file)
+        with self.assertRaisesRegex(LockError, r'^Error occured while opening lockfile .*/test.lock:.*Is a directory'):
+            FileLock(self.lock_file).acquire()
+
+
+class TestPostgresAdvisoryLock(TestCase):
+    """Test PostgresAdvisoryLock."""
+
+    def test_key(self):
+        self.assertEqual(PostgresAdvisoryLock('test').key, PostgresAdvisoryLock('test').key)
+        self.assertNotEqual(PostgresAdvisoryLock('test').key, PostgresAdvisoryLock('test.0').key)
+        self.assertLess(abs(PostgresAdvisoryLock('test').key), 2 ** 63)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Advisory locks require PostgreSQL.')
+    def test_acquire_release(self):
+        lock = PostgresAdvisoryLock('test')
+        self.assertTrue(lock.acquire())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+            self.assertEqual(cursor.fetchone()[0], 1)
+        lock.release()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    @skipIf(connection.vendor == 'postgresql', 'Advisory locks are supported by PostgreSQL.')
+    def test_not_supported(self):
+        with self.assertRaisesMessage(LockError, 'Advisory lock test requires PostgreSQL database'):
+            PostgresAdvisoryLock('test').acquire()
@@ -26,8 +26,8 @@ from django.test import SimpleTestCase, TestCase, override_settings
 from djmoney.money import Money
 from teller.statement import Payment
 
-from django_pain.constants import InvoiceType, PaymentType
-from django_pain.models import BankPayment
+from django_pain.constants import InvoiceType, PaymentState, PaymentType
+from django_pain.models import AccountSnapshot, BankPayment
 
 from .mixins import CacheResetMixin
 from .utils import get_account, get_invoice, get_payment
@@ -41,6 +41,11 @@ class TestBankAccount(SimpleTestCase):
         account = get_account(account_name='Account', account_number='123')
         self.assertEqual(str(account), 'Account 123')
 
+    def test_get_snapshot(self):
+        account = get_account(pk=1, account_name='Account', account_number='123', currency='USD')
+        self.assertEqual(account.get_snapshot(), AccountSnapshot(pk=1, account_number='123', account_name='Account',
+                                                                 currency='USD'))
+
 
 class TestBankPayment(CacheResetMixin, TestCase):
     """Test BankPayment model."""
@@ -155,3 +160,27 @@ class TestBankPayment(CacheResetMixin, TestCase):
         self.assertEqual(model.constant_symbol, '')
         self.assertEqual(model.variable_symbol, '')
         self.assertEqual(model.specific_symbol, '')
+
+    def test_get_snapshot(self):
+        account = get_account(pk=1)
+        payment = get_payment(pk=2, account=account, processor='dummy', variable_symbol='123')
+
+        snapshot = payment.get_snapshot()
+
+        self.assertEqual(snapshot.pk, 2)
+        self.assertEqual(snapshot.identifier, payment.identifier)
+        self.assertEqual(snapshot.uuid, payment.uuid)
+        self.assertEqual(snapshot.account, account.get_snapshot())
+        self.assertEqual(snapshot.transaction_date, payment.transaction_date)
+        self.assertEqual(snapshot.counter_account_number, payment.counter_account_number)
+        self.assertEqual(snapshot.amount, payment.amount)
+        self.assertEqual(snapshot.state, payment.state)
+        self.assertEqual(snapshot.variable_symbol, '123')
+        self.assertEqual(snapshot.processor, 'dummy')
+        with self.assertRaises(AttributeError):
+            setattr(snapshot, 'state', PaymentState.PROCESSED)
+
+    def test_get_snapshot_shared_account(self):
+        account_snapshot = get_account(pk=1).get_snapshot()
+        payment = get_payment(account=None)
+        self.assertIs(payment.get_snapshot(account_snapshot).account, account_snapshot)
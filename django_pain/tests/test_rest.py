@@ -20,10 +20,11 @@ import datetime
 from collections import OrderedDict
 from unittest.mock import Mock, patch
 
+from django.core.cache import caches
 from django.test import TestCase, override_settings
 from pycsob import conf as CSOB
 
-from django_pain.card_payment_handlers import PaymentHandlerConnectionError
+from django_pain.card_payment_handlers import PaymentHandlerConnectionError, PaymentHandlerError
 from django_pain.constants import PaymentState, PaymentType
 from django_pain.models import BankPayment
 from django_pain.serializers import ExternalPaymentState
@@ -66,7 +67,7 @@ class TestBankPaymentRestAPI(CacheResetMixin, TestCase):
         account.save()
         payment = get_payment(identifier='1', account=account, counter_account_number='',
                               payment_type=PaymentType.CARD_PAYMENT,
-                              state=PaymentState.READY_TO_PROCESS,
+                              state=PaymentState.INITIALIZED,
                               card_handler='csob')
         payment.save()
 
@@ -77,6 +78,127 @@ class TestBankPaymentRestAPI(CacheResetMixin, TestCase):
 
         self.assertEqual(response.status_code, 503)
 
+    @override_settings(PAIN_PROCESSORS={
+        'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'})
+    def test_retrieve_changed_meanwhile(self):
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT, processor='dummy',
+                              state=PaymentState.INITIALIZED,
+                              card_handler='csob')
+        payment.save()
+
+        result_mock = Mock()
+        result_mock.payload = {'paymentStatus': CSOB.PAYMENT_STATUS_CONFIRMED, 'resultCode': CSOB.RETURN_CODE_OK}
+
+        def payment_status(pay_id):
+            # Payment is canceled by someone else during the gateway request.
+            BankPayment.objects.filter(pk=payment.pk).update(state=PaymentState.CANCELED)
+            return result_mock
+
+        card_payment_hadler = get_card_payment_handler_instance(payment.card_handler)
+        with patch.object(card_payment_hadler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.side_effect = payment_status
+            response = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], ExternalPaymentState.CANCELED)
+        self.assertEqual(BankPayment.objects.get(pk=payment.pk).state, PaymentState.CANCELED)
+
+    def test_retrieve_final_state(self):
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT,
+                              state=PaymentState.PROCESSED,
+                              card_handler='csob')
+        payment.save()
+
+        card_payment_hadler = get_card_payment_handler_instance(payment.card_handler)
+        with patch.object(card_payment_hadler, '_client') as gateway_client_mock:
+            response = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], ExternalPaymentState.PAID)
+        self.assertEqual(gateway_client_mock.mock_calls, [])
+
+    @override_settings(PAIN_CARD_PAYMENT_STATE_CACHE_TIMEOUT=60)
+    def test_retrieve_state_cached(self):
+        caches['default'].clear()
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT,
+                              state=PaymentState.INITIALIZED,
+                              card_handler='csob')
+        payment.save()
+
+        result_mock = Mock()
+        result_mock.payload = {'paymentStatus': CSOB.PAYMENT_STATUS_PROCESS, 'resultCode': CSOB.RETURN_CODE_OK}
+
+        card_payment_hadler = get_card_payment_handler_instance(payment.card_handler)
+        with patch.object(card_payment_hadler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.return_value = result_mock
+            response = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+            response2 = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(response2.data['state'], ExternalPaymentState.INITIALIZED)
+        self.assertEqual(gateway_client_mock.payment_status.call_count, 1)
+
+    @override_settings(PAIN_CARD_PAYMENT_STATE_CACHE_TIMEOUT=60)
+    def test_retrieve_state_cache_connection_error(self):
+        caches['default'].clear()
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT,
+                              state=PaymentState.INITIALIZED,
+                              card_handler='csob')
+        payment.save()
+
+        result_mock = Mock()
+        result_mock.payload = {'paymentStatus': CSOB.PAYMENT_STATUS_CANCELLED, 'resultCode': CSOB.RETURN_CODE_OK}
+
+        card_payment_hadler = get_card_payment_handler_instance(payment.card_handler)
+        with patch.object(card_payment_hadler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.side_effect = [PaymentHandlerConnectionError(), result_mock]
+            response = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+            response2 = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(response2.data['state'], ExternalPaymentState.CANCELED)
+
+    @override_settings(PAIN_CARD_PAYMENT_STATE_CACHE_TIMEOUT=60)
+    def test_retrieve_state_cache_gateway_error(self):
+        caches['default'].clear()
+        account = get_account(account_number='123456', currency='CZK')
+        account.save()
+        payment = get_payment(identifier='1', account=account, counter_account_number='',
+                              payment_type=PaymentType.CARD_PAYMENT,
+                              state=PaymentState.INITIALIZED,
+                              card_handler='csob')
+        payment.save()
+
+        error_mock = Mock()
+        error_mock.payload = {'resultCode': CSOB.RETURN_CODE_MERCHANT_BLOCKED}
+        result_mock = Mock()
+        result_mock.payload = {'paymentStatus': CSOB.PAYMENT_STATUS_CANCELLED, 'resultCode': CSOB.RETURN_CODE_OK}
+
+        card_payment_hadler = get_card_payment_handler_instance(payment.card_handler)
+        with patch.object(card_payment_hadler, '_client') as gateway_client_mock:
+            gateway_client_mock.payment_status.side_effect = [error_mock, result_mock]
+            with self.assertRaises(PaymentHandlerError):
+                self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+            response = self.client.get('/api/private/bankpayment/{}/'.format(payment.uuid))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], ExternalPaymentState.CANCELED)
+        self.assertEqual(gateway_client_mock.payment_status.call_count, 2)
+
     @override_settings(PAIN_PROCESSORS={
         'dummy': 'django_pain.tests.commands.test_process_payments.DummyTruePaymentProcessor'})
     def test_retrieve_process_paid(self):
@@ -127,7 +249,7 @@ class TestBankPaymentRestAPI(CacheResetMixin, TestCase):
         account = get_account(account_number='123456', currency='CZK')
         account.save()
 
-        with patch('django_pain.card_payment_handlers.csob.CsobClient') as gateway_client_mock:
+        with patch('django_pain.card_payment_handlers.csob.CachedKeysCsobClient') as gateway_client_mock:
             gateway_client_mock.return_value.gateway_return.return_value = OrderedDict([
                 ('payId', 'unique_id_123'),
                 ('resultCode', 0),
@@ -154,7 +276,7 @@ class TestBankPaymentRestAPI(CacheResetMixin, TestCase):
         account = get_account(account_number='123456', currency='CZK')
         account.save()
 
-        with patch('django_pain.card_payment_handlers.csob.CsobClient') as gateway_client_mock:
+        with patch('django_pain.card_payment_handlers.csob.CachedKeysCsobClient') as gateway_client_mock:
             gateway_client_mock.side_effect = PaymentHandlerConnectionError()
             response = self.client.post('/api/private/bankpayment/', data={
                 'amount': '1000',
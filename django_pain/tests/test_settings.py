@@ -58,6 +58,20 @@ class TestProcessorsSetting(SimpleTestCase):
             SETTINGS.check()
 
 
+class TestProcessPaymentsLockBackendSetting(SimpleTestCase):
+    """Test process_payments_lock_backend setting."""
+
+    @override_settings(PAIN_PROCESS_PAYMENTS_LOCK_BACKEND='django_pain.locks.PostgresAdvisoryLock')
+    def test_ok(self):
+        SETTINGS.check()
+        self.assertEqual(SETTINGS.process_payments_lock_backend, 'django_pain.locks.PostgresAdvisoryLock')
+
+    @override_settings(PAIN_PROCESS_PAYMENTS_LOCK_BACKEND='django_pain.tests.test_settings.DummyDownloader')
+    def test_not_correct_subclass(self):
+        with self.assertRaisesRegex(ImproperlyConfigured, 'is not a subclass of AbstractLock'):
+            SETTINGS.check()
+
+
 class DummyDownloader(BankStatementDownloader):
     """Dummy class which does not do anything. It is used in TestDownloadersSetting."""
 
@@ -22,7 +22,8 @@ from datetime import date, datetime
 from django.test import SimpleTestCase
 
 from django_pain.models.bank import BankAccount
-from django_pain.utils import full_class_name, parse_date_safe, parse_datetime_safe
+from django_pain.utils import (chunked, full_class_name, parse_date_safe, parse_datetime_safe, parse_positive_float,
+                               parse_positive_int)
 
 
 class FullClassNameTest(SimpleTestCase):
@@ -54,3 +55,48 @@ class ParseDatetimeSafeTest(SimpleTestCase):
             parse_datetime_safe('2017-01-32 00:00')
         with self.assertRaises(ValueError):
             parse_datetime_safe('not a date')
+
+
+class ParsePositiveIntTest(SimpleTestCase):
+
+    def test_parse_positive_int(self):
+        self.assertEqual(parse_positive_int('42'), 42)
+
+    def test_parse_positive_int_fails_on_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_positive_int('0')
+        with self.assertRaises(ValueError):
+            parse_positive_int('-1')
+        with self.assertRaises(ValueError):
+            parse_positive_int('not a number')
+
+
+class ParsePositiveFloatTest(SimpleTestCase):
+
+    def test_parse_positive_float(self):
+        self.assertEqual(parse_positive_float('0.5'), 0.5)
+
+    def test_parse_positive_float_fails_on_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_positive_float('0')
+        with self.assertRaises(ValueError):
+            parse_positive_float('-1.5')
+        with self.assertRaises(ValueError):
+            parse_positive_float('nan')
+        with self.assertRaises(ValueError):
+            parse_positive_float('not a number')
+
+
+class ChunkedTest(SimpleTestCase):
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_chunked_empty(self):
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_chunked_lazy(self):
+        iterator = iter(range(5))
+        chunks = chunked(iterator, 2)
+        self.assertEqual(next(chunks), [0, 1])
+        self.assertEqual(next(iterator), 2)
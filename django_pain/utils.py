@@ -18,9 +18,14 @@
 
 """Various utils."""
 from datetime import date, datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
 
+from django.db import connections
 from django.utils.dateparse import parse_date, parse_datetime
 
+T = TypeVar('T')
+
 
 def full_class_name(cls):
     """Return full class name includeing the module path."""
@@ -41,3 +46,33 @@ def parse_datetime_safe(value: str) -> datetime:
     if result is None:
         raise ValueError('Could not parse date_time.')
     return result
+
+
+def parse_positive_int(value: str) -> int:
+    """Parse positive integer, raise an exception when unsuccessful."""
+    result = int(value)
+    if result < 1:
+        raise ValueError('Value has to be a positive integer.')
+    return result
+
+
+def parse_positive_float(value: str) -> float:
+    """Parse positive number, raise an exception when unsuccessful."""
+    result = float(value)
+    if not result > 0:
+        raise ValueError('Value has to be a positive number.')
+    return result
+
+
+def close_connections_before_fork() -> None:
+    """Close database connections of this process, so they are not shared with worker processes."""
+    connections.close_all()
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split iterable into lists of at most `size` items. Iterable is consumed lazily."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
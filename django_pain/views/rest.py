@@ -18,8 +18,8 @@
 
 """REST API module."""
 import logging
-from copy import deepcopy
 
+from django.core.cache import caches
 from django.db import transaction
 from rest_framework import mixins, routers, status, viewsets
 from rest_framework.response import Response
@@ -27,23 +27,26 @@ from rest_framework.response import Response
 from django_pain.card_payment_handlers import PaymentHandlerConnectionError
 from django_pain.constants import PaymentState, PaymentType
 from django_pain.models import BankPayment
+from django_pain.processors import prepare_payments
 from django_pain.serializers import BankPaymentSerializer
-from django_pain.settings import get_card_payment_handler_instance, get_processor_instance
+from django_pain.settings import SETTINGS, get_card_payment_handler_instance, get_processor_instance
 
 LOGGER = logging.getLogger(__name__)
 
+STATE_CACHE_KEY = 'django_pain.card_payment_state.{}'
+
 
 class BankPaymentViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """BankPayment API for create and retrieve."""
 
-    queryset = BankPayment.objects.filter(payment_type=PaymentType.CARD_PAYMENT).select_for_update()
+    queryset = BankPayment.objects.filter(payment_type=PaymentType.CARD_PAYMENT)
     serializer_class = BankPaymentSerializer
     lookup_field = 'uuid'
 
     def _process_payment(self, payment):
         processor = get_processor_instance(payment.processor)
         LOGGER.info('Processing card payment with processor %s.', processor)
-        result = list(processor.process_payments([deepcopy(payment)]))[0]
+        result = list(processor.process_payments(prepare_payments(processor, [payment])))[0]
         if result.result:
             payment.state = PaymentState.PROCESSED
         else:
@@ -52,20 +55,58 @@ class BankPaymentViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, vie
         payment.processing_error = result.error
         payment.save()
 
-    @transaction.atomic()
+    @staticmethod
+    def _reserve_state_update(payment: BankPayment) -> bool:
+        """
+        Return whether state of the payment should be requested from the gateway.
+
+        Only the first request within PAIN_CARD_PAYMENT_STATE_CACHE_TIMEOUT gets True, other requests use the state
+        stored in the database.
+        """
+        timeout = SETTINGS.card_payment_state_cache_timeout
+        if not timeout:
+            return True
+        return caches[SETTINGS.card_payment_state_cache].add(STATE_CACHE_KEY.format(payment.uuid), True, timeout)
+
+    @staticmethod
+    def _release_state_update(payment: BankPayment) -> None:
+        """Let the next request for the payment ask the gateway again."""
+        if SETTINGS.card_payment_state_cache_timeout:
+            caches[SETTINGS.card_payment_state_cache].delete(STATE_CACHE_KEY.format(payment.uuid))
+
+    def _save_state(self, payment: BankPayment) -> BankPayment:
+        """
+        Save state of the payment obtained from the gateway and process the payment if it is newly paid.
+
+        Payment is locked and its state is updated only if it was not changed in the meantime.
+        Return the current payment.
+        """
+        with transaction.atomic():
+            current = self.get_queryset().select_for_update().get(pk=payment.pk)
+            if current.state == PaymentState.INITIALIZED:
+                current.state = payment.state
+                current.card_payment_state = payment.card_payment_state
+                current.save(update_fields=('state', 'card_payment_state'))
+            if payment.state == PaymentState.READY_TO_PROCESS and current.state == PaymentState.READY_TO_PROCESS:
+                self._process_payment(current)
+        return current
+
     def retrieve(self, request, *args, **kwargs):
         """Update payment state and return update payment."""
         payment = self.get_object()
-        old_payment_state = payment.state
-
-        card_payment_handler = get_card_payment_handler_instance(payment.card_handler)
-        try:
-            card_payment_handler.update_payments_state(payment)
-        except PaymentHandlerConnectionError:
-            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        if old_payment_state == PaymentState.INITIALIZED and payment.state == PaymentState.READY_TO_PROCESS:
-            self._process_payment(payment)
+        # Only initialized payments may change their state, other states are final.
+        if payment.state == PaymentState.INITIALIZED and self._reserve_state_update(payment):
+            # Gateway is requested without any lock or transaction, the payment is locked only to save the result.
+            card_payment_handler = get_card_payment_handler_instance(payment.card_handler)
+            result = card_payment_handler.get_payments_states([payment])[0]
+            if result.error is not None:
+                # Failed request does not count, the next request asks the gateway again.
+                self._release_state_update(payment)
+                if isinstance(result.error, PaymentHandlerConnectionError):
+                    return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+                raise result.error
+            payment = self._save_state(payment)
 
         serializer = BankPaymentSerializer(payment)
         return Response(serializer.data)
@@ -0,0 +1,62 @@
+#
+# Copyright (C) 2026  CZ.NIC, z. s. p. o.
+#
+# This file is part of FRED.
+#
+# FRED is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# FRED is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with FRED.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compare throughput of CSOB message signing and verification with and without cached keys."""
+import os  # isort:skip
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_pain.tests.settings')  # noqa: E402
+
+import django  # isort:skip
+django.setup()  # noqa: E402
+
+import argparse
+import tempfile
+import timeit
+from collections import OrderedDict
+
+from Crypto.PublicKey import RSA
+from pycsob import utils
+
+from django_pain.card_payment_handlers import csob_signing
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('-n', '--number', type=int, default=1000, help='number of operations in each measurement')
+parser.add_argument('-b', '--bits', type=int, default=2048, help='size of generated RSA key')
+args = parser.parse_args()
+
+key = RSA.generate(args.bits)
+with tempfile.TemporaryDirectory() as directory:
+    private_key = os.path.join(directory, 'private.key')
+    public_key = os.path.join(directory, 'public.key')
+    with open(private_key, 'wb') as handle:
+        handle.write(key.exportKey())
+    with open(public_key, 'wb') as handle:
+        handle.write(key.publickey().exportKey())
+
+    payload = OrderedDict([('merchantId', 'A1029DTmM7'), ('payId', '1234abcd'), ('dttm', utils.dttm())])
+    signature = utils.sign(payload, private_key)
+
+    benchmarks = [
+        ('sign (pycsob)', lambda: utils.sign(payload, private_key)),
+        ('sign (cached key)', lambda: csob_signing.sign(payload, private_key)),
+        ('verify (pycsob)', lambda: utils.verify(payload, signature, public_key)),
+        ('verify (cached key)', lambda: csob_signing.verify(payload, signature, public_key)),
+    ]
+    for name, function in benchmarks:
+        elapsed = timeit.timeit(function, number=args.number)
+        print('{:>20}: {:10.1f} ops/s {:10.1f} us/op'.format(name, args.number / elapsed,
+                                                            elapsed / args.number * 1e6))